@@ -0,0 +1,346 @@
+"""
+Two-tier cache of classification results.
+
+Notification and marketing senders repeatedly produce near-identical
+emails, each of which would otherwise cost a full LLM round-trip. Results
+are keyed on a hash of everything that determines the classification
+(model, prompt, labels, and normalized email content):
+1. L1: in-process LRU, hits in microseconds.
+2. L2: optional SQLite table that survives restarts, with TTL expiry.
+
+An optional in-memory near-duplicate tier also matches emails from the
+same sender domain whose SimHash fingerprints differ by only a few bits,
+such as templated notifications that vary only in an order number.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Quoted reply lines ("> ..."), which vary between otherwise identical emails
+_QUOTED_LINE = re.compile(r"^\s*>.*$", re.MULTILINE)
+
+# URLs usually carry per-recipient tracking tokens
+_URL = re.compile(r"https?://\S+", re.IGNORECASE)
+
+_WHITESPACE = re.compile(r"\s+")
+
+_WORD = re.compile(r"\w+")
+
+_SENDER_DOMAIN = re.compile(r"@([\w.-]+)")
+
+# Order numbers, dates, and amounts vary between templated emails
+_DIGITS = re.compile(r"\d+")
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """
+    Normalize email text so near-duplicate emails produce the same key.
+
+    Args:
+        text: Raw email field (may be None)
+
+    Returns:
+        Lowercased text with quoted replies, URLs, and whitespace runs removed
+    """
+    if not text:
+        return ""
+    text = _QUOTED_LINE.sub("", text)
+    text = _URL.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def simhash(text: Optional[str]) -> int:
+    """
+    Compute a 64-bit SimHash fingerprint of normalized text.
+
+    Digit runs are masked, and texts sharing most of their word trigrams
+    get fingerprints that differ in only a few bits.
+
+    Args:
+        text: Raw text (may be None)
+
+    Returns:
+        64-bit fingerprint (0 for empty text)
+    """
+    words = _WORD.findall(_DIGITS.sub("0", normalize_text(text)))
+    shingles = [" ".join(words[i : i + 3]) for i in range(max(1, len(words) - 2))]
+    votes = [0] * 64
+    for shingle in shingles:
+        if not shingle:
+            continue
+        digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        for bit in range(64):
+            votes[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if votes[bit] > 0)
+
+
+class ClassificationCache:
+    """In-process LRU backed by an optional SQLite store."""
+
+    DEFAULT_MAX_ENTRIES = 10_000
+    DEFAULT_TTL_DAYS = 30
+
+    # Near-duplicate tier: maximum differing fingerprint bits for a hit,
+    # and bounds on the sender scopes and fingerprints kept per scope
+    SIMILAR_MAX_DISTANCE = 3
+    SIMILAR_MAX_SCOPES = 1024
+    SIMILAR_PER_SCOPE = 256
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_days: int = DEFAULT_TTL_DAYS,
+        near_duplicates: bool = False,
+    ):
+        """
+        Args:
+            db_path: SQLite database path for the persistent tier
+                (None keeps the cache in memory only)
+            max_entries: Maximum entries held in the in-process tier
+            ttl_days: Days before an entry expires (<= 0 never expires)
+            near_duplicates: Also match near-duplicate emails from the same
+                sender domain (in memory only)
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 86400 if ttl_days > 0 else None
+        self.near_duplicates = near_duplicates
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._similar: "OrderedDict[str, OrderedDict[int, tuple]]" = OrderedDict()
+        # classify_email runs on worker threads; guard both tiers
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str):
+        """Open the SQLite tier; continue memory-only on failure."""
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, labels TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            if self.ttl_seconds is not None:
+                self._db.execute(
+                    "DELETE FROM cache WHERE ts < ?", (time.time() - self.ttl_seconds,)
+                )
+            self._db.commit()
+            logger.info(f"Opened classification cache at {db_path}")
+        except sqlite3.Error as e:
+            self._db = None
+            logger.error(
+                f"Failed to open classification cache '{db_path}': {e}. "
+                f"Continuing with in-memory cache only."
+            )
+
+    @staticmethod
+    def make_key(
+        model: str,
+        classification_prompt: str,
+        available_labels: List[str],
+        email: Dict,
+    ) -> str:
+        """
+        Build the cache key for classifying an email.
+
+        Args:
+            model: Model ID used for classification
+            classification_prompt: The classification instructions
+            available_labels: List of available label names
+            email: Email dictionary with subject, from, body fields
+
+        Returns:
+            Hex SHA-256 digest identifying the classification request
+        """
+        canonical = json.dumps(
+            [
+                model,
+                classification_prompt,
+                sorted(available_labels),
+                normalize_text(email.get("from")),
+                normalize_text(email.get("subject")),
+                normalize_text(email.get("body", email.get("snippet"))),
+            ],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def make_similarity_key(
+        self,
+        model: str,
+        classification_prompt: str,
+        available_labels: List[str],
+        email: Dict,
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Build the near-duplicate key for classifying an email.
+
+        Args:
+            model: Model ID used for classification
+            classification_prompt: The classification instructions
+            available_labels: List of available label names
+            email: Email dictionary with subject, from, body fields
+
+        Returns:
+            (scope, fingerprint), where scope covers the model, prompt,
+            labels, and sender domain; None if the tier is disabled
+        """
+        if not self.near_duplicates:
+            return None
+        domain = _SENDER_DOMAIN.search(email.get("from") or "")
+        scope = json.dumps(
+            [
+                model,
+                classification_prompt,
+                sorted(available_labels),
+                domain.group(1).lower() if domain else "",
+            ],
+            ensure_ascii=False,
+        )
+        fingerprint = simhash(
+            f"{email.get('subject') or ''}\n"
+            f"{email.get('body', email.get('snippet')) or ''}"
+        )
+        return hashlib.sha256(scope.encode("utf-8")).hexdigest(), fingerprint
+
+    def lookup_similar(
+        self, similarity_key: Optional[Tuple[str, int]]
+    ) -> Optional[List[str]]:
+        """
+        Look up labels cached for a near-duplicate email.
+
+        Args:
+            similarity_key: Key from make_similarity_key
+
+        Returns:
+            Cached labels of the closest match, or None on a miss
+        """
+        if similarity_key is None:
+            return None
+        scope, fingerprint = similarity_key
+        with self._lock:
+            entries = self._similar.get(scope)
+            if not entries:
+                return None
+            best = None
+            for candidate, (labels, ts) in entries.items():
+                distance = bin(candidate ^ fingerprint).count("1")
+                if distance <= self.SIMILAR_MAX_DISTANCE and not self._expired(ts):
+                    if best is None or distance < best[0]:
+                        best = (distance, labels)
+            return list(best[1]) if best else None
+
+    def _expired(self, ts: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - ts > self.ttl_seconds
+
+    def lookup(self, key: str) -> Optional[List[str]]:
+        """
+        Look up cached labels.
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Cached labels, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                labels, ts = entry
+                if not self._expired(ts):
+                    self._entries.move_to_end(key)
+                    return list(labels)
+                del self._entries[key]
+
+            if self._db is None:
+                return None
+
+            try:
+                row = self._db.execute(
+                    "SELECT labels, ts FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"Error reading classification cache: {e}")
+                return None
+
+            if row is None or self._expired(row[1]):
+                return None
+
+            try:
+                labels = json.loads(row[0])
+                if not isinstance(labels, list):
+                    raise TypeError(f"expected a list, got {type(labels).__name__}")
+            except (ValueError, TypeError) as e:
+                # Drop the bad row so the email is classified afresh
+                logger.warning(f"Discarding corrupt classification cache entry: {e}")
+                try:
+                    self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Error writing classification cache: {e}")
+                return None
+
+            self._remember(key, labels, row[1])
+            return list(labels)
+
+    def update(
+        self,
+        key: str,
+        labels: List[str],
+        similarity_key: Optional[Tuple[str, int]] = None,
+    ):
+        """
+        Store labels for a key in both tiers.
+
+        Args:
+            key: Key from make_key
+            labels: Labels predicted for the email
+            similarity_key: Key from make_similarity_key, if any
+        """
+        ts = time.time()
+        with self._lock:
+            self._remember(key, labels, ts)
+            if similarity_key is not None:
+                self._remember_similar(similarity_key, labels, ts)
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache (key, labels, ts) VALUES (?, ?, ?)",
+                    (key, json.dumps(labels), ts),
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing classification cache: {e}")
+
+    def _remember(self, key: str, labels: List[str], ts: float):
+        """Insert into the LRU tier, evicting the oldest entry when full."""
+        self._entries[key] = (tuple(labels), ts)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _remember_similar(
+        self, similarity_key: Tuple[str, int], labels: List[str], ts: float
+    ):
+        """Insert into the near-duplicate tier, evicting the oldest entries."""
+        scope, fingerprint = similarity_key
+        entries = self._similar.setdefault(scope, OrderedDict())
+        self._similar.move_to_end(scope)
+        entries[fingerprint] = (tuple(labels), ts)
+        entries.move_to_end(fingerprint)
+        while len(entries) > self.SIMILAR_PER_SCOPE:
+            entries.popitem(last=False)
+        while len(self._similar) > self.SIMILAR_MAX_SCOPES:
+            self._similar.popitem(last=False)
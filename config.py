@@ -2,8 +2,12 @@ import os
 import json
 from pathlib import Path
 from dotenv import load_dotenv
+from sender_rules import RULE_FIELDS, compile_rules
 
-load_dotenv()
+# Deployments that inject the environment directly (Docker env_file, CI)
+# can set SKIP_DOTENV=true to skip searching for a .env file
+if os.getenv("SKIP_DOTENV", "false").lower() != "true":
+    load_dotenv()
 
 
 def load_classifier_config(config_path: str) -> dict:
@@ -14,7 +18,8 @@ def load_classifier_config(config_path: str) -> dict:
         config_path: Path to the classifier configuration JSON file
 
     Returns:
-        Dictionary containing 'labels' and 'classification_prompt'
+        Dictionary containing 'labels', 'classification_prompt', and
+        optionally 'rules'
 
     Raises:
         FileNotFoundError: If config file doesn't exist
@@ -44,6 +49,28 @@ def load_classifier_config(config_path: str) -> dict:
         if len(config["labels"]) == 0:
             raise ValueError("'labels' must contain at least one label")
 
+        # Optional sender/subject rules that bypass the LLM
+        rules = config.get("rules", {})
+        if not isinstance(rules, dict):
+            raise ValueError("'rules' must be an object mapping labels to patterns")
+        for label, rule in rules.items():
+            if label not in config["labels"]:
+                raise ValueError(f"Rule label '{label}' is not in 'labels'")
+            if not isinstance(rule, dict) or not set(rule) <= set(RULE_FIELDS):
+                raise ValueError(
+                    f"Rule for '{label}' must be an object with 'from' and/or "
+                    f"'subject' lists"
+                )
+            for field, patterns in rule.items():
+                if not isinstance(patterns, list) or not all(
+                    isinstance(p, str) and p for p in patterns
+                ):
+                    raise ValueError(
+                        f"'{field}' in rule for '{label}' must be a list of "
+                        f"non-empty strings"
+                    )
+        compile_rules(rules)
+
         return config
 
     except json.JSONDecodeError as e:
@@ -108,6 +135,7 @@ try:
     _classifier_config = load_classifier_config(CLASSIFIER_CONFIG_PATH)
     LABELS = _classifier_config["labels"]
     CLASSIFICATION_PROMPT = _classifier_config["classification_prompt"]
+    RULES = _classifier_config.get("rules", {})
 except (FileNotFoundError, ValueError) as e:
     print(f"Error loading classifier config: {e}")
     print("Please ensure classifier_config.json exists and is properly formatted.")
@@ -115,6 +143,11 @@ except (FileNotFoundError, ValueError) as e:
 
 # OpenRouter API Configuration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "5"))
+OPENROUTER_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_TIMEOUT_SECONDS", "60"))
+OPENROUTER_STRUCTURED_OUTPUT = (
+    os.getenv("OPENROUTER_STRUCTURED_OUTPUT", "false").lower() == "true"
+)
 
 # Model Configuration - Load from file if available, otherwise from env vars
 MODEL_CONFIG_PATH = os.getenv("MODEL_CONFIG_PATH")
@@ -131,12 +164,12 @@ if MODEL_CONFIG_PATH:
         print("Falling back to environment variables.")
         OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet")
         OPENROUTER_TEMPERATURE = float(os.getenv("OPENROUTER_TEMPERATURE", "0.0"))
-        OPENROUTER_MAX_TOKENS = int(os.getenv("OPENROUTER_MAX_TOKENS", "1000"))
+        OPENROUTER_MAX_TOKENS = int(os.getenv("OPENROUTER_MAX_TOKENS", "64"))
 else:
     # Fallback to environment variables
     OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet")
     OPENROUTER_TEMPERATURE = float(os.getenv("OPENROUTER_TEMPERATURE", "0.0"))
-    OPENROUTER_MAX_TOKENS = int(os.getenv("OPENROUTER_MAX_TOKENS", "1000"))
+    OPENROUTER_MAX_TOKENS = int(os.getenv("OPENROUTER_MAX_TOKENS", "64"))
 
 # Gmail Configuration
 GMAIL_CREDENTIALS_PATH = os.getenv("GMAIL_CREDENTIALS_PATH", "credentials.json")
@@ -154,9 +187,29 @@ INJECTION_ML_MODEL = os.getenv(
 )
 INJECTION_ML_THRESHOLD = float(os.getenv("INJECTION_ML_THRESHOLD", "0.98"))
 
+# Classification Cache Configuration
+CLASSIFICATION_CACHE_ENABLED = (
+    os.getenv("CLASSIFICATION_CACHE_ENABLED", "true").lower() == "true"
+)
+CLASSIFICATION_CACHE_PATH = os.getenv(
+    "CLASSIFICATION_CACHE_PATH", ".classification_cache.db"
+)
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "10000"))
+CLASSIFICATION_CACHE_TTL_DAYS = int(os.getenv("CLASSIFICATION_CACHE_TTL_DAYS", "30"))
+CLASSIFICATION_CACHE_NEAR_DUPLICATES = (
+    os.getenv("CLASSIFICATION_CACHE_NEAR_DUPLICATES", "false").lower() == "true"
+)
+
 # Application Configuration
 POLL_INTERVAL_SECONDS = int(os.getenv("POLL_INTERVAL_SECONDS", "60"))
+# Empty polls back off up to this interval; equal to the poll interval
+# (the default) keeps polling at a fixed rate
+MAX_POLL_INTERVAL_SECONDS = int(
+    os.getenv("MAX_POLL_INTERVAL_SECONDS", str(POLL_INTERVAL_SECONDS))
+)
 MAX_EMAILS_PER_POLL = int(os.getenv("MAX_EMAILS_PER_POLL", "10"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "1"))
 STATE_FILE = os.getenv("STATE_FILE", ".email_state.json")
 STATE_RETENTION_DAYS = int(os.getenv("STATE_RETENTION_DAYS", "30"))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
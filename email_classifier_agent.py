@@ -1,10 +1,13 @@
 import time
 import logging
-from datetime import datetime, timezone
-from typing import Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from classification_cache import ClassificationCache
 from gmail_client import GmailClient
 from injection_guard import InjectionGuard
 from openrouter_classifier import OpenRouterClassifier
+from sender_rules import SenderRules
 import config
 import state_store
 
@@ -14,6 +17,15 @@ logger = logging.getLogger(__name__)
 class EmailClassifierAgent:
     """Main agent for classifying and labeling Gmail emails."""
 
+    # Journal entries to accumulate before rewriting the state snapshot
+    STATE_COMPACT_EVERY = 1000
+
+    # Seconds between retention cleanups (state is also cleaned on load)
+    STATE_CLEANUP_INTERVAL = 3600
+
+    # Growth of the poll interval after each poll that finds no emails
+    POLL_BACKOFF_FACTOR = 1.5
+
     def __init__(self):
         """Initialize the email classifier agent."""
         # Initialize Gmail client
@@ -24,12 +36,33 @@ class EmailClassifierAgent:
             headless=config.GMAIL_HEADLESS_MODE,
         )
 
+        # Cache results so repeated near-identical emails skip the LLM
+        cache = None
+        if config.CLASSIFICATION_CACHE_ENABLED:
+            cache = ClassificationCache(
+                db_path=config.CLASSIFICATION_CACHE_PATH,
+                max_entries=config.CLASSIFICATION_CACHE_SIZE,
+                ttl_days=config.CLASSIFICATION_CACHE_TTL_DAYS,
+                near_duplicates=config.CLASSIFICATION_CACHE_NEAR_DUPLICATES,
+            )
+
         # Initialize OpenRouter classifier
         self.classifier = OpenRouterClassifier(
             api_key=config.OPENROUTER_API_KEY,
             model=config.OPENROUTER_MODEL,
             temperature=config.OPENROUTER_TEMPERATURE,
             max_tokens=config.OPENROUTER_MAX_TOKENS,
+            cache=cache,
+            max_retries=config.OPENROUTER_MAX_RETRIES,
+            timeout=config.OPENROUTER_TIMEOUT_SECONDS,
+            structured_output=config.OPENROUTER_STRUCTURED_OUTPUT,
+        )
+
+        # Worker threads for the blocking classifier calls, reused across
+        # polls; the pool size bounds concurrent LLM requests
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, config.LLM_CONCURRENCY),
+            thread_name_prefix="classifier",
         )
 
         # Create Gmail labels if they don't exist
@@ -48,10 +81,26 @@ class EmailClassifierAgent:
                 config.INJECTION_QUARANTINE_LABEL
             )
 
+        # Sender/subject rules label obvious emails without the LLM
+        self.sender_rules = SenderRules(config.RULES) if config.RULES else None
+
         # Load processed email state
         self.state_file = config.STATE_FILE
         self.retention_days = config.STATE_RETENTION_DAYS
-        self.processed_emails: Dict[str, str] = self._load_state()
+        self.processed_emails: Dict[str, int] = self._load_state()
+        # Processed emails are appended to a journal; the number of changes
+        # since the last snapshot decides when to compact it
+        self._journal = state_store.open_journal(self.state_file)
+        self._unsaved = 0
+        if self._journal is not None and self._journal.tell():
+            # Fold the previous run's journal (and retention pruning) into the
+            # snapshot, so restarts before STATE_COMPACT_EVERY keep it bounded
+            self._save_state()
+        self._next_cleanup = time.time() + self.STATE_CLEANUP_INTERVAL
+
+        # Mailbox history ID of the last poll that found no new emails; while
+        # set, polls check for inbox changes before listing unread emails
+        self._history_id: Optional[str] = None
 
         logger.info(
             f"Email Classifier Agent initialized with OpenRouter (model: {config.OPENROUTER_MODEL})"
@@ -77,17 +126,60 @@ class EmailClassifierAgent:
         logger.info(f"Initialized {len(label_map)} Gmail labels")
         return label_map
 
-    def _load_state(self) -> Dict[str, str]:
+    def _load_state(self) -> Dict[str, int]:
         """Load processed email IDs with timestamps from state file."""
         return state_store.load_state(self.state_file, self.retention_days)
 
-    def _cleanup_old_state(self, processed_emails: Dict[str, str]) -> Dict[str, str]:
+    def _cleanup_old_state(self, processed_emails: Dict[str, int]) -> Dict[str, int]:
         """Remove entries older than retention period."""
         return state_store.cleanup_old_state(processed_emails, self.retention_days)
 
     def _save_state(self):
-        """Save processed email IDs with timestamps to state file."""
-        state_store.save_state(self.state_file, self.processed_emails)
+        """Save a snapshot of processed emails, emptying the journal."""
+        if state_store.save_state(self.state_file, self.processed_emails):
+            if self._journal is not None:
+                self._journal.flush()
+                self._journal.truncate(0)
+            self._unsaved = 0
+
+    def _mark_processed(self, email_id: str):
+        """Record an email as processed with a single journal append."""
+        timestamp = int(time.time())
+        self.processed_emails[email_id] = timestamp
+        self._unsaved += 1
+        if self._journal is not None:
+            state_store.append_journal(self._journal, email_id, timestamp)
+        self._maybe_flush()
+
+    def _maybe_flush(self, force: bool = False):
+        """
+        Persist unsaved state changes.
+
+        Journal appends are flushed to disk; once STATE_COMPACT_EVERY of
+        them accumulate, the snapshot is rewritten and the journal
+        emptied. Without a journal, the snapshot is rewritten instead.
+
+        Args:
+            force: Persist unsaved changes now rather than leaving journal
+                appends buffered
+        """
+        if not self._unsaved:
+            return
+        if self._unsaved >= self.STATE_COMPACT_EVERY or (
+            force and self._journal is None
+        ):
+            self._save_state()
+        elif force:
+            self._journal.flush()
+
+    def _maybe_cleanup_state(self):
+        """Drop expired state entries at most once per STATE_CLEANUP_INTERVAL."""
+        now = time.time()
+        if now < self._next_cleanup:
+            return
+        # Removals need no write: entries are re-filtered whenever state loads
+        self.processed_emails = self._cleanup_old_state(self.processed_emails)
+        self._next_cleanup = now + self.STATE_CLEANUP_INTERVAL
 
     def process_email(self, email: Dict) -> bool:
         """
@@ -99,41 +191,220 @@ class EmailClassifierAgent:
         Returns:
             True if successfully processed, False otherwise
         """
+        return self.process_emails([email]) == 1
+
+    def process_emails(self, emails: List[Dict]) -> int:
+        """
+        Process a batch of emails, classifying them concurrently.
+
+        Pre-classification checks and Gmail updates run sequentially on the
+        calling thread (the Gmail client is not thread-safe); only the
+        network-bound LLM calls run on the worker pool, at most
+        LLM_CONCURRENCY at a time. Each batch of CLASSIFY_BATCH_SIZE emails
+        is submitted as soon as it is ready, so LLM calls overlap the checks
+        on the remaining emails.
+
+        Args:
+            emails: Email dictionaries from Gmail API
+
+        Returns:
+            Number of emails successfully processed
+        """
+        processed_count = 0
+        batch_size = max(1, config.CLASSIFY_BATCH_SIZE)
+        pending = []
+        # (emails, future) for each batch submitted to the worker pool
+        submitted: List[Tuple[List[Dict], Future]] = []
+        # Label ID set -> email IDs, applied with one Gmail call per set
+        label_groups: Dict[Tuple[str, ...], List[str]] = {}
+        # Content key -> later copies of an email already queued for the LLM
+        duplicates: Dict[Tuple, List[Dict]] = {}
+        for email in emails:
+            to_classify, handled = self._prepare_email(email)
+            if to_classify is None:
+                if handled:
+                    processed_count += 1
+                continue
+
+            # Rules run after the injection guard, so quarantine still wins
+            rule_labels = (
+                self.sender_rules.match(to_classify) if self.sender_rules else []
+            )
+            if rule_labels:
+                logger.info(
+                    "Sender rules matched %s for email: %.50s",
+                    rule_labels,
+                    to_classify["subject"],
+                )
+                if self._apply_classification(to_classify, rule_labels, label_groups):
+                    processed_count += 1
+            else:
+                key = self._duplicate_key(to_classify)
+                if key in duplicates:
+                    # The queued copy's labels are reused for this one
+                    duplicates[key].append(to_classify)
+                    continue
+                duplicates[key] = []
+                pending.append(to_classify)
+                if len(pending) == batch_size:
+                    submitted.append((pending, self._submit_classification(pending)))
+                    pending = []
+
+        if pending:
+            submitted.append((pending, self._submit_classification(pending)))
+
+        if self.sender_rules:
+            logger.debug(
+                f"Sender rules matched {self.sender_rules.matched} of "
+                f"{self.sender_rules.checked} emails so far"
+            )
+
+        for batch, future in submitted:
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                # A failed batch fails each of its emails
+                outcomes = [e] * len(batch)
+            for email, outcome in zip(batch, outcomes):
+                copies = duplicates[self._duplicate_key(email)]
+                for message in [email] + copies:
+                    if self._apply_classification(message, outcome, label_groups):
+                        processed_count += 1
+
+        try:
+            if label_groups:
+                processed_count += self._apply_label_groups(label_groups)
+        finally:
+            # Persist what was recorded even if labeling raised
+            self._maybe_flush(force=True)
+        return processed_count
+
+    @staticmethod
+    def _duplicate_key(email: Dict) -> Tuple:
+        """
+        Key identifying emails that would get the same classification.
+
+        Copies of one message (a newsletter delivered twice, a cross-posted
+        announcement) share subject, sender and body, and only the first
+        copy in a poll is sent to the LLM.
+
+        Args:
+            email: Sanitized email dictionary
+
+        Returns:
+            Tuple of the fields the classification depends on
+        """
+        return (
+            email.get("subject"),
+            email.get("from"),
+            email.get("body", email.get("snippet")),
+        )
+
+    def _prepare_email(self, email: Dict) -> Tuple[Optional[Dict], bool]:
+        """
+        Run the checks that must pass before an email reaches the LLM.
+
+        Args:
+            email: Email dictionary from Gmail API
+
+        Returns:
+            Tuple of (email to classify, handled result). The email is None
+            when no classification is needed, in which case the result
+            says whether it was handled successfully.
+        """
         try:
             email_id = email.get("id")
             if not email_id:
                 logger.error("Email missing ID field")
-                return False
+                return None, False
 
             # Check if already processed
             if email_id in self.processed_emails:
                 logger.info(
-                    f"Skipping already processed email: {email['subject'][:50]}..."
+                    "Skipping already processed email: %.50s...", email["subject"]
                 )
-                return True  # Return True since it was successfully handled before
+                return None, True  # Successfully handled before
 
-            logger.info(f"Processing email: {email['subject'][:50]}...")
+            logger.info("Processing email: %.50s...", email["subject"])
 
             # Scan for prompt injection BEFORE any content reaches the LLM
             if self.injection_guard is not None:
                 scan = self.injection_guard.scan(email)
                 if scan.flagged:
-                    return self._quarantine_email(email, scan.reasons)
+                    return None, self._quarantine_email(email, scan.reasons)
                 # Use the sanitized content for classification
                 email = scan.sanitized_email
 
-            # Classify the email
-            predicted_labels = self.classifier.classify_email(
-                email=email,
+            return email, False
+
+        except Exception as e:
+            logger.error(f"Error processing email {email.get('id', 'unknown')}: {e}")
+            return None, False
+
+    def _submit_classification(self, batch: List[Dict]) -> Future:
+        """
+        Start classifying a batch of emails on the worker pool.
+
+        A single email uses classify_email; larger batches are sent as one
+        request. The OpenAI SDK client is thread-safe, so workers share the
+        classifier.
+
+        Args:
+            batch: Sanitized emails to classify together
+
+        Returns:
+            Future resolving to the predicted labels for each email, in order
+        """
+        if len(batch) == 1:
+            return self._executor.submit(
+                lambda: [
+                    self.classifier.classify_email(
+                        email=batch[0],
+                        classification_prompt=config.CLASSIFICATION_PROMPT,
+                        available_labels=config.LABELS,
+                    )
+                ]
+            )
+        return self._executor.submit(
+            partial(
+                self.classifier.classify_emails_batch,
+                emails=batch,
                 classification_prompt=config.CLASSIFICATION_PROMPT,
                 available_labels=config.LABELS,
             )
+        )
+
+    def _apply_classification(
+        self,
+        email: Dict,
+        predicted_labels,
+        label_groups: Dict[Tuple[str, ...], List[str]],
+    ) -> bool:
+        """
+        Queue predicted labels for an email, or record it as processed.
+
+        Emails queued in label_groups are recorded as processed by
+        _apply_label_groups once their labels have been applied.
+
+        Args:
+            email: Sanitized email dictionary
+            predicted_labels: Labels from the classifier, or the exception
+                raised while classifying
+            label_groups: Label ID set -> email IDs, applied by the caller
+
+        Returns:
+            True if the email was processed without needing labels applied,
+            False if it failed or was queued
+        """
+        email_id = email["id"]
+        try:
+            if isinstance(predicted_labels, Exception):
+                raise predicted_labels
 
             if not predicted_labels:
-                logger.warning(f"No labels predicted for email: {email['subject']}")
+                logger.warning("No labels predicted for email: %s", email["subject"])
                 # Still mark as processed to avoid re-attempting
-                self.processed_emails[email_id] = datetime.now(timezone.utc).isoformat()
-                self._save_state()
+                self._mark_processed(email_id)
                 return False
 
             # Get Gmail label IDs
@@ -144,33 +415,48 @@ class EmailClassifierAgent:
             ]
 
             if label_ids:
-                # Apply labels to the email and optionally remove from inbox
-                self.gmail_client.add_labels_to_message(
-                    email["id"], label_ids, remove_from_inbox=config.REMOVE_FROM_INBOX
-                )
-                action = (
-                    "Applied labels and archived"
-                    if config.REMOVE_FROM_INBOX
-                    else "Applied labels"
-                )
+                # Emails with the same labels are updated in one Gmail call
+                label_groups.setdefault(tuple(sorted(label_ids)), []).append(email_id)
                 logger.info(
-                    f"{action} {predicted_labels} to email: {email['subject'][:50]}"
-                )
-            else:
-                logger.warning(
-                    f"No valid label IDs found for predicted labels: {predicted_labels}"
+                    "Labeling email as %s: %.50s", predicted_labels, email["subject"]
                 )
+                return False
 
-            # Mark as processed with timestamp and save state
-            self.processed_emails[email_id] = datetime.now(timezone.utc).isoformat()
-            self._save_state()
+            logger.warning(
+                f"No valid label IDs found for predicted labels: {predicted_labels}"
+            )
+
+            # Mark as processed with timestamp
+            self._mark_processed(email_id)
 
             return True
 
         except Exception as e:
-            logger.error(f"Error processing email {email.get('id', 'unknown')}: {e}")
+            logger.error(f"Error processing email {email_id}: {e}")
             return False
 
+    def _apply_label_groups(
+        self, label_groups: Dict[Tuple[str, ...], List[str]]
+    ) -> int:
+        """
+        Apply queued labels and record the labeled emails as processed.
+
+        Emails whose labels could not be applied stay unprocessed, so they
+        are retried on the next poll.
+
+        Args:
+            label_groups: Label ID set -> email IDs from _apply_classification
+
+        Returns:
+            Number of emails labeled
+        """
+        labeled = self.gmail_client.batch_apply_labels(
+            label_groups, remove_from_inbox=config.REMOVE_FROM_INBOX
+        )
+        for email_id in labeled:
+            self._mark_processed(email_id)
+        return len(labeled)
+
     def _quarantine_email(self, email: Dict, reasons: List[str]) -> bool:
         """
         Quarantine a suspicious email without sending it to the LLM.
@@ -193,16 +479,82 @@ class EmailClassifierAgent:
             self.gmail_client.add_labels_to_message(
                 email["id"], [self.quarantine_label_id], remove_from_inbox=False
             )
-        self.processed_emails[email["id"]] = datetime.now(timezone.utc).isoformat()
-        self._save_state()
+        self._mark_processed(email["id"])
         return True
 
-    def run_continuous(self):
+    def _fetch_new_emails(self) -> List[Dict]:
+        """
+        Fetch unread emails that have not been processed yet.
+
+        Once a poll finds nothing new, later polls only ask the History API
+        whether messages entered the inbox since then, and skip listing
+        unread emails while nothing has changed.
+
+        Returns:
+            Email dictionaries from Gmail API
+        """
+        if self._history_id is not None:
+            changed, history_id = self.gmail_client.get_inbox_changes(self._history_id)
+            if not changed:
+                logger.debug("Inbox unchanged since last poll")
+                self._history_id = history_id or self._history_id
+                return []
+
+        # Taken before listing, so messages arriving meanwhile count as changes
+        history_id = self.gmail_client.get_history_id()
+        emails = self.gmail_client.get_unread_messages(
+            max_results=config.MAX_EMAILS_PER_POLL, skip_ids=self.processed_emails
+        )
+        if emails is None:
+            # Listing failed; retry the full list next poll
+            self._history_id = None
+            return []
+
+        # Keep listing until the unread backlog is drained
+        self._history_id = None if emails else history_id
+        return emails
+
+    def _next_poll_interval(
+        self, interval: float, found_emails: bool, max_interval: float
+    ) -> float:
+        """
+        Compute the wait before the next poll.
+
+        Empty polls grow the interval by POLL_BACKOFF_FACTOR up to
+        max_interval; any new email resets it to POLL_INTERVAL_SECONDS.
+
+        Args:
+            interval: Interval used before the poll that just finished
+            found_emails: Whether that poll returned any emails
+            max_interval: Upper bound for the interval
+
+        Returns:
+            Seconds to sleep before the next poll
+        """
+        base = config.POLL_INTERVAL_SECONDS
+        if found_emails:
+            return base
+        return max(base, min(max_interval, interval * self.POLL_BACKOFF_FACTOR))
+
+    def run_continuous(self, max_poll_interval: Optional[float] = None):
         """
         Run the agent continuously, polling for new emails.
+
+        Args:
+            max_poll_interval: Longest wait between polls while the inbox
+                stays empty (default: config.MAX_POLL_INTERVAL_SECONDS)
         """
+        if max_poll_interval is None:
+            max_poll_interval = config.MAX_POLL_INTERVAL_SECONDS
+        interval = config.POLL_INTERVAL_SECONDS
+
         logger.info(
-            f"Starting continuous email classifier agent (polling every {config.POLL_INTERVAL_SECONDS}s)"
+            f"Starting continuous email classifier agent (polling every {interval}s"
+            + (
+                f", backing off to {max_poll_interval}s when idle)"
+                if max_poll_interval > interval
+                else ")"
+            )
         )
 
         while True:
@@ -210,38 +562,41 @@ class EmailClassifierAgent:
                 logger.info("=== Checking for new emails ===")
 
                 # Cleanup old state entries periodically
-                self.processed_emails = self._cleanup_old_state(self.processed_emails)
+                self._maybe_cleanup_state()
 
                 # Get unread emails
-                emails = self.gmail_client.get_unread_messages(
-                    max_results=config.MAX_EMAILS_PER_POLL
-                )
+                emails = self._fetch_new_emails()
 
                 if not emails:
                     logger.debug("No unread emails to process")
                 else:
-                    # Process each email
-                    processed_count = 0
-                    for email in emails:
-                        if self.process_email(email):
-                            processed_count += 1
+                    processed_count = self.process_emails(emails)
 
                     logger.info(
                         f"=== Processed {processed_count} out of {len(emails)} emails ==="
                     )
 
+                # Persist this poll's state changes
+                self._maybe_flush(force=True)
+
                 # Wait before next poll
-                logger.debug(f"Sleeping for {config.POLL_INTERVAL_SECONDS} seconds...")
-                time.sleep(config.POLL_INTERVAL_SECONDS)
+                interval = self._next_poll_interval(
+                    interval, bool(emails), max_poll_interval
+                )
+                logger.debug(f"Sleeping for {interval:g} seconds...")
+                time.sleep(interval)
 
             except KeyboardInterrupt:
                 logger.info("Received interrupt signal, shutting down gracefully...")
+                self._maybe_flush(force=True)
                 break
             except Exception as e:
                 logger.error(f"Error in continuous loop: {e}")
-                logger.info(
-                    f"Waiting {config.POLL_INTERVAL_SECONDS} seconds before retry..."
-                )
-                time.sleep(config.POLL_INTERVAL_SECONDS)
+                interval = config.POLL_INTERVAL_SECONDS
+                logger.info(f"Waiting {interval} seconds before retry...")
+                time.sleep(interval)
 
+        self._executor.shutdown(wait=False)
+        if self._journal is not None:
+            self._journal.close()
         logger.info("Email Classifier Agent stopped")
@@ -1,8 +1,11 @@
 import os
+import json
 import pickle
 import base64
-from typing import List, Dict, Optional
+from typing import Container, List, Dict, Optional, Tuple
+import httplib2
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
@@ -13,9 +16,47 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _decode_body(data: str, max_chars: Optional[int] = None) -> str:
+    """
+    Decode base64url body data as UTF-8.
+
+    Args:
+        data: base64url-encoded body data
+        max_chars: If set, decode only enough data for this many characters
+
+    Returns:
+        Decoded text (at most max_chars characters)
+    """
+    if max_chars is not None:
+        # UTF-8 needs at most 4 bytes per character, and every 4 base64
+        # characters encode 3 bytes; cut on a 4-character boundary
+        data = data[: -(-max_chars * 4 // 3) * 4]
+    text = base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+    return text[:max_chars] if max_chars is not None else text
+
+
 class GmailClient:
     """Client for interacting with Gmail API."""
 
+    # Requests per batch HTTP call. Gmail allows 100, but recommends at
+    # most 50 to avoid per-user rate limiting.
+    BATCH_SIZE = 50
+
+    # Maximum message IDs per messages.batchModify call
+    BATCH_MODIFY_SIZE = 1000
+
+    # Socket timeout for Gmail API calls
+    HTTP_TIMEOUT_SECONDS = 60
+
+    # Body characters kept for classification
+    MAX_BODY_CHARS = 5000
+
+    # Partial response for message gets: only the fields _parse_message reads
+    MESSAGE_FIELDS = (
+        "id,snippet,payload(mimeType,headers(name,value),body/data,"
+        "parts(mimeType,body/data))"
+    )
+
     def __init__(
         self,
         credentials_path: str,
@@ -28,16 +69,19 @@ class GmailClient:
         self.scopes = scopes
         self.headless = headless
         self.service = None
+        # Label name -> ID, fetched once by list_labels and kept up to date
+        # by create_label
+        self._label_ids: Optional[Dict[str, str]] = None
         self._authenticate()
 
     def _authenticate(self):
         """Authenticate and build Gmail service."""
         creds = None
+        migrated = False
 
         # Load existing token if available
         if os.path.exists(self.token_path):
-            with open(self.token_path, "rb") as token:
-                creds = pickle.load(token)
+            creds, migrated = self._load_token()
 
         # If no valid credentials, get new ones
         if not creds or not creds.valid:
@@ -57,13 +101,55 @@ class GmailClient:
                     # Browser mode: open browser automatically
                     creds = flow.run_local_server(port=8080)
 
-            # Save credentials for next run
-            with open(self.token_path, "wb") as token:
-                pickle.dump(creds, token)
+            self._save_token(creds)
+        elif migrated:
+            self._save_token(creds)
 
-        self.service = build("gmail", "v1", credentials=creds)
+        # One authorized connection is kept alive and reused by every call,
+        # batches included, for the lifetime of the client
+        http = AuthorizedHttp(
+            creds, http=httplib2.Http(timeout=self.HTTP_TIMEOUT_SECONDS)
+        )
+        self.service = build("gmail", "v1", http=http)
         logger.info("Gmail API authentication successful")
 
+    def _load_token(self) -> Tuple[Credentials, bool]:
+        """
+        Load saved credentials from the token file.
+
+        Tokens are stored as authorized-user JSON. Files written by older
+        versions were pickled; those are still read once so they can be
+        rewritten as JSON.
+
+        Returns:
+            Tuple of (credentials, whether the file was a legacy pickle)
+        """
+        with open(self.token_path, "rb") as token:
+            data = token.read()
+
+        try:
+            info = json.loads(data)
+        except ValueError:
+            logger.info(f"Migrating pickled token {self.token_path} to JSON")
+            return pickle.loads(data), True
+
+        return Credentials.from_authorized_user_info(info, self.scopes), False
+
+    def _save_token(self, creds: Credentials):
+        """
+        Save credentials to the token file as JSON for the next run.
+
+        Args:
+            creds: Credentials to persist
+        """
+        try:
+            with open(self.token_path, "w") as token:
+                token.write(creds.to_json())
+        except OSError as e:
+            # Token mounts are often read-only; the in-memory credentials
+            # still work for this run
+            logger.warning(f"Could not save token to {self.token_path}: {e}")
+
     def _run_console_flow(self, flow):
         """
         Run OAuth flow in console/headless mode.
@@ -89,21 +175,33 @@ class GmailClient:
 
         return flow.credentials
 
-    def get_unread_messages(self, max_results: int = 10) -> List[Dict]:
+    def get_unread_messages(
+        self, max_results: int = 10, skip_ids: Optional[Container[str]] = None
+    ) -> Optional[List[Dict]]:
         """
         Get unread messages from inbox.
 
         Args:
             max_results: Maximum number of messages to retrieve
+            skip_ids: IDs of messages whose details need not be fetched
+                (e.g. already processed)
 
         Returns:
             List of message dictionaries with id, subject, from, body
+            (empty when there are no unread messages left to fetch), or
+            None if the messages could not be listed or fetched
         """
         try:
             results = (
                 self.service.users()
                 .messages()
-                .list(userId="me", labelIds=["INBOX", "UNREAD"], maxResults=max_results)
+                .list(
+                    userId="me",
+                    labelIds=["INBOX", "UNREAD"],
+                    maxResults=max_results,
+                    # Only IDs are needed; details come from the batched gets
+                    fields="messages/id",
+                )
                 .execute()
             )
 
@@ -115,128 +213,244 @@ class GmailClient:
 
             logger.info(f"Found {len(messages)} unread messages")
 
-            # Get full message details
-            detailed_messages = []
-            for msg in messages:
-                detailed_msg = self._get_message_details(msg["id"])
-                if detailed_msg:
-                    detailed_messages.append(detailed_msg)
+            msg_ids = [msg["id"] for msg in messages]
+            if skip_ids is not None:
+                msg_ids = [msg_id for msg_id in msg_ids if msg_id not in skip_ids]
+                if not msg_ids:
+                    logger.info("All unread messages were already processed")
+                    return []
 
-            return detailed_messages
+            # Get full message details
+            details = self._get_messages_details(msg_ids)
+            if not details:
+                logger.error("Failed to fetch details for all unread messages")
+                return None
+            return details
 
         except HttpError as error:
             logger.error(f"An error occurred: {error}")
-            return []
+            return None
+
+    def get_history_id(self) -> Optional[str]:
+        """
+        Get the mailbox's current history ID.
 
-    def _get_message_details(self, msg_id: str) -> Optional[Dict]:
-        """Get detailed information about a specific message."""
+        Returns:
+            History ID to pass to get_inbox_changes, or None on error
+        """
         try:
-            message = (
+            profile = (
                 self.service.users()
-                .messages()
-                .get(userId="me", id=msg_id, format="full")
+                .getProfile(userId="me", fields="historyId")
                 .execute()
             )
+            return profile["historyId"]
 
-            headers = message["payload"].get("headers", [])
-            subject = next(
-                (h["value"] for h in headers if h["name"].lower() == "subject"),
-                "No Subject",
-            )
-            from_email = next(
-                (h["value"] for h in headers if h["name"].lower() == "from"), "Unknown"
-            )
-            date = next(
-                (h["value"] for h in headers if h["name"].lower() == "date"), "Unknown"
-            )
+        except HttpError as error:
+            logger.error(f"Error getting mailbox history ID: {error}")
+            return None
 
-            # Get message body
-            body = self._get_message_body(message["payload"])
+    def get_inbox_changes(self, start_history_id: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check whether messages entered the inbox since a history ID.
 
-            return {
-                "id": msg_id,
-                "subject": subject,
-                "from": from_email,
-                "date": date,
-                "body": body[:5000],  # Limit body to 5000 chars to avoid token limits
-                "snippet": message.get("snippet", ""),
-            }
+        Args:
+            start_history_id: History ID from get_history_id or a previous call
+
+        Returns:
+            Tuple of (changed, current history ID). Changed is True when it
+            cannot be determined, e.g. because the history ID has expired.
+        """
+        try:
+            results = (
+                self.service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded", "labelAdded"],
+                    labelId="INBOX",
+                    # Whether anything changed is enough
+                    maxResults=1,
+                    fields="history/id,historyId",
+                )
+                .execute()
+            )
+            return bool(results.get("history")), results.get("historyId")
 
         except HttpError as error:
-            logger.error(f"Error getting message details for {msg_id}: {error}")
-            return None
+            # Gmail keeps history for about a week; older IDs return 404
+            logger.warning(f"Error listing mailbox history: {error}")
+            return True, None
+
+    def _get_messages_details(self, msg_ids: List[str]) -> List[Dict]:
+        """
+        Get detailed information about several messages.
+
+        Fetches are grouped into batch HTTP requests of BATCH_SIZE, so N
+        messages cost ceil(N / BATCH_SIZE) round trips instead of N.
+
+        Args:
+            msg_ids: Message IDs to fetch
+
+        Returns:
+            Message dictionaries in the order of msg_ids; messages that
+            could not be fetched are omitted
+        """
+        fetched: Dict[str, Dict] = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                logger.error(
+                    f"Error getting message details for {request_id}: {exception}"
+                )
+                return
+            fetched[request_id] = self._parse_message(request_id, response)
+
+        for start in range(0, len(msg_ids), self.BATCH_SIZE):
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for msg_id in msg_ids[start : start + self.BATCH_SIZE]:
+                batch.add(
+                    self.service.users()
+                    .messages()
+                    .get(
+                        userId="me",
+                        id=msg_id,
+                        format="full",
+                        fields=self.MESSAGE_FIELDS,
+                    ),
+                    request_id=msg_id,
+                )
+            try:
+                batch.execute()
+            except HttpError as error:
+                logger.error(f"Error executing message batch: {error}")
+
+        return [fetched[msg_id] for msg_id in msg_ids if msg_id in fetched]
+
+    def _parse_message(self, msg_id: str, message: Dict) -> Dict:
+        """Extract headers and body from a full-format message resource."""
+        headers = message["payload"].get("headers", [])
+        subject = next(
+            (h["value"] for h in headers if h["name"].lower() == "subject"),
+            "No Subject",
+        )
+        from_email = next(
+            (h["value"] for h in headers if h["name"].lower() == "from"), "Unknown"
+        )
+        date = next(
+            (h["value"] for h in headers if h["name"].lower() == "date"), "Unknown"
+        )
+
+        # Get message body
+        body = self._get_message_body(message["payload"])
+
+        return {
+            "id": msg_id,
+            "subject": subject,
+            "from": from_email,
+            "date": date,
+            # Limit body length to avoid token limits
+            "body": body[: self.MAX_BODY_CHARS],
+            "snippet": message.get("snippet", ""),
+        }
 
     def _get_message_body(self, payload: Dict) -> str:
         """Extract message body from payload, converting HTML to plain text."""
-        body = ""
-        is_html = False
-
-        if "parts" in payload:
-            for part in payload["parts"]:
-                if part["mimeType"] == "text/plain":
-                    if "data" in part["body"]:
-                        body = base64.urlsafe_b64decode(part["body"]["data"]).decode(
-                            "utf-8"
-                        )
-                        is_html = False
-                        break
-                elif part["mimeType"] == "text/html" and not body:
-                    if "data" in part["body"]:
-                        body = base64.urlsafe_b64decode(part["body"]["data"]).decode(
-                            "utf-8"
-                        )
-                        is_html = True
-        elif "body" in payload and "data" in payload["body"]:
-            body = base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8")
-            is_html = payload.get("mimeType") == "text/html"
-
-        if is_html and body:
+        part = self._select_body_part(payload)
+        if part is None:
+            return ""
+
+        data = part["body"]["data"]
+        if part.get("mimeType") == "text/html":
             # Strip markup and hidden elements so concealed instructions
             # never reach the classification prompt
-            body = html_to_text(body)
+            return html_to_text(_decode_body(data))
+
+        # Plain text is truncated anyway; decode only what can be kept
+        return _decode_body(data, self.MAX_BODY_CHARS)
+
+    @staticmethod
+    def _select_body_part(payload: Dict) -> Optional[Dict]:
+        """Pick the part holding the body: text/plain, else text/html."""
+        if "parts" not in payload:
+            return payload if "data" in payload.get("body", {}) else None
+
+        html_part = None
+        for part in payload["parts"]:
+            if "data" not in part.get("body", {}):
+                continue
+            if part.get("mimeType") == "text/plain":
+                return part
+            if part.get("mimeType") == "text/html" and html_part is None:
+                html_part = part
+        return html_part
+
+    def list_labels(self) -> Dict[str, str]:
+        """
+        Get all Gmail labels, fetching them at most once per client.
 
-        return body
+        Returns:
+            Dictionary mapping label names to label IDs
 
-    def create_label_if_not_exists(self, label_name: str) -> str:
+        Raises:
+            HttpError: If the label list cannot be fetched
         """
-        Create a Gmail label if it doesn't exist.
+        if self._label_ids is None:
+            results = self.service.users().labels().list(userId="me").execute()
+            self._label_ids = {
+                label["name"]: label["id"] for label in results.get("labels", [])
+            }
+        return self._label_ids
+
+    def create_label(self, label_name: str) -> str:
+        """
+        Create a Gmail label without checking whether it exists.
 
         Args:
             label_name: Name of the label to create
 
         Returns:
             Label ID
+
+        Raises:
+            HttpError: If the label cannot be created
         """
-        try:
-            # Check if label already exists
-            results = self.service.users().labels().list(userId="me").execute()
-            labels = results.get("labels", [])
+        label_object = {
+            "name": label_name,
+            "labelListVisibility": "labelShow",
+            "messageListVisibility": "show",
+        }
+
+        created_label = (
+            self.service.users()
+            .labels()
+            .create(userId="me", body=label_object)
+            .execute()
+        )
+
+        logger.info(f"Created new label '{label_name}' with ID: {created_label['id']}")
+        if self._label_ids is not None:
+            self._label_ids[label_name] = created_label["id"]
+        return created_label["id"]
 
-            for label in labels:
-                if label["name"] == label_name:
-                    logger.debug(
-                        f"Label '{label_name}' already exists with ID: {label['id']}"
-                    )
-                    return label["id"]
+    def create_label_if_not_exists(self, label_name: str) -> str:
+        """
+        Create a Gmail label if it doesn't exist.
 
-            # Create new label
-            label_object = {
-                "name": label_name,
-                "labelListVisibility": "labelShow",
-                "messageListVisibility": "show",
-            }
+        Args:
+            label_name: Name of the label to create
 
-            created_label = (
-                self.service.users()
-                .labels()
-                .create(userId="me", body=label_object)
-                .execute()
-            )
+        Returns:
+            Label ID
+        """
+        try:
+            label_id = self.list_labels().get(label_name)
+            if label_id:
+                logger.debug(f"Label '{label_name}' already exists with ID: {label_id}")
+                return label_id
 
-            logger.info(
-                f"Created new label '{label_name}' with ID: {created_label['id']}"
-            )
-            return created_label["id"]
+            return self.create_label(label_name)
 
         except HttpError as error:
             logger.error(f"Error creating label '{label_name}': {error}")
@@ -272,6 +486,46 @@ class GmailClient:
         except HttpError as error:
             logger.error(f"Error adding labels to message {msg_id}: {error}")
 
+    def batch_apply_labels(
+        self,
+        groups: Dict[Tuple[str, ...], List[str]],
+        remove_from_inbox: bool = False,
+    ) -> List[str]:
+        """
+        Add labels to many messages with one batchModify call per label set.
+
+        Args:
+            groups: Mapping of label ID tuple -> IDs of messages to label
+            remove_from_inbox: If True, remove INBOX label (archive the emails)
+
+        Returns:
+            IDs of the messages that were labeled
+        """
+        action = "Added labels and archived" if remove_from_inbox else "Added labels to"
+        labeled: List[str] = []
+        for label_ids, msg_ids in groups.items():
+            body = {"addLabelIds": list(label_ids)}
+            if remove_from_inbox:
+                body["removeLabelIds"] = ["INBOX"]
+
+            for start in range(0, len(msg_ids), self.BATCH_MODIFY_SIZE):
+                chunk = msg_ids[start : start + self.BATCH_MODIFY_SIZE]
+                try:
+                    self.service.users().messages().batchModify(
+                        userId="me", body={"ids": chunk, **body}
+                    ).execute()
+                    labeled.extend(chunk)
+                    logger.info(f"{action} {len(chunk)} messages")
+                # Socket timeouts and connection failures surface as
+                # OSError / HttpLib2Error rather than HttpError
+                except (HttpError, OSError, httplib2.HttpLib2Error) as error:
+                    logger.error(
+                        f"Error adding labels {list(label_ids)} to "
+                        f"{len(chunk)} messages: {error}"
+                    )
+
+        return labeled
+
     def mark_as_read(self, msg_id: str):
         """Mark a message as read."""
         try:
@@ -279,7 +533,7 @@ class GmailClient:
                 userId="me", id=msg_id, body={"removeLabelIds": ["UNREAD"]}
             ).execute()
 
-            logger.debug(f"Marked message {msg_id} as read")
+            logger.debug("Marked message %s as read", msg_id)
 
         except HttpError as error:
             logger.error(f"Error marking message {msg_id} as read: {error}")
@@ -294,7 +548,7 @@ class GmailClient:
                 userId="me", id=msg_id, body={"removeLabelIds": ["INBOX"]}
             ).execute()
 
-            logger.debug(f"Archived message {msg_id}")
+            logger.debug("Archived message %s", msg_id)
 
         except HttpError as error:
             logger.error(f"Error archiving message {msg_id}: {error}")
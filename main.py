@@ -36,6 +36,12 @@ def main():
         default=config.LOG_LEVEL,
         help="Logging level",
     )
+    parser.add_argument(
+        "--max-poll-interval",
+        type=int,
+        default=config.MAX_POLL_INTERVAL_SECONDS,
+        help="Longest wait in seconds between polls while the inbox is idle",
+    )
 
     args = parser.parse_args()
 
@@ -50,6 +56,7 @@ def main():
     logger.info(f"Model: {config.OPENROUTER_MODEL}")
     logger.info(f"Labels: {', '.join(config.LABELS)}")
     logger.info(f"Poll Interval: {config.POLL_INTERVAL_SECONDS}s")
+    logger.info(f"Max Poll Interval: {args.max_poll_interval}s")
     logger.info("=" * 60)
 
     try:
@@ -57,7 +64,7 @@ def main():
         agent = EmailClassifierAgent()
 
         # Run in continuous mode
-        agent.run_continuous()
+        agent.run_continuous(max_poll_interval=args.max_poll_interval)
 
     except KeyboardInterrupt:
         logger.info("\nShutting down gracefully...")
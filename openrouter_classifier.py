@@ -5,17 +5,31 @@ Uses OpenRouter API (OpenAI-compatible) to classify emails.
 """
 
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+try:
+    import openai
+except ImportError:
+    openai = None
+
+from classification_cache import ClassificationCache
 from llm_utils import (
     construct_email_content,
     build_classification_messages,
+    build_batch_classification_messages,
+    labels_response_format,
     parse_labels_from_response,
+    parse_batch_labels_from_response,
     log_classification_result,
 )
 
 logger = logging.getLogger(__name__)
 
 
+class TruncatedResponseError(Exception):
+    """Raised when a reply cut off by max_tokens yielded no labels."""
+
+
 class OpenRouterClassifier:
     """OpenRouter API implementation for email classification."""
 
@@ -24,7 +38,11 @@ class OpenRouterClassifier:
         api_key: str,
         model: str = "anthropic/claude-3.5-sonnet",
         temperature: float = 0.0,
-        max_tokens: int = 1000,
+        max_tokens: int = 64,
+        cache: Optional[ClassificationCache] = None,
+        max_retries: int = 5,
+        timeout: float = 60.0,
+        structured_output: bool = False,
     ):
         """
         Initialize OpenRouter classifier.
@@ -34,32 +52,46 @@ class OpenRouterClassifier:
             model: Model ID (default: anthropic/claude-3.5-sonnet)
                    See https://openrouter.ai/docs for available models
             temperature: Sampling temperature (0.0-2.0, default: 0.0)
-            max_tokens: Maximum tokens in response (default: 1000)
+            max_tokens: Maximum tokens in response (default: 64, ample for a
+                JSON label list)
+            cache: Optional cache consulted before calling the API
+            max_retries: Retries, with exponential backoff, for rate limits
+                (429), timeouts, and server errors (default: 5)
+            timeout: Per-request timeout in seconds (default: 60)
+            structured_output: Request a JSON schema restricted to the
+                available labels (only for models that support it)
         """
-        try:
-            import openai
-
-            self.client = openai.OpenAI(
-                api_key=api_key,
-                base_url="https://openrouter.ai/api/v1",
-                default_headers={
-                    "HTTP-Referer": ("https://github.com/tgrecojr/gmailclassifier"),
-                    "X-Title": "gmailclassifier",
-                },
-            )
-            self.model = model
-            self.temperature = temperature
-            self.max_tokens = max_tokens
-            logger.info(
-                f"Initialized OpenRouter classifier with model: {model}, "
-                f"temperature: {temperature}, max_tokens: {max_tokens}"
-            )
-        except ImportError:
+        if openai is None:
             raise ImportError(
                 "openai package is required for OpenRouter. "
                 "Install it with: pip install openai"
             )
 
+        # A single client is shared by all worker threads, so its
+        # keep-alive connection pool is reused across requests
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            base_url="https://openrouter.ai/api/v1",
+            default_headers={
+                "HTTP-Referer": ("https://github.com/tgrecojr/gmailclassifier"),
+                "X-Title": "gmailclassifier",
+            },
+            max_retries=max_retries,
+            timeout=openai.Timeout(timeout, connect=5.0),
+        )
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.cache = cache
+        self.structured_output = structured_output
+        # Anthropic models only cache prompts at explicit breakpoints;
+        # other OpenRouter providers cache shared prefixes automatically
+        self.prompt_cache_control = model.startswith("anthropic/")
+        logger.info(
+            f"Initialized OpenRouter classifier with model: {model}, "
+            f"temperature: {temperature}, max_tokens: {max_tokens}"
+        )
+
     def classify_email(
         self, email: Dict, classification_prompt: str, available_labels: List[str]
     ) -> List[str]:
@@ -73,13 +105,26 @@ class OpenRouterClassifier:
 
         Returns:
             List of applicable label names
+
+        Raises:
+            TruncatedResponseError: If the reply hit max_tokens before any
+                label was returned
         """
         try:
+            cache_keys, cached_labels = self._cache_lookup(
+                email, classification_prompt, available_labels
+            )
+            if cached_labels is not None:
+                return cached_labels
+
             # Construct hardened messages: instructions in the system
             # message, untrusted email content delimited in the user message
             email_content = construct_email_content(email)
             messages = build_classification_messages(
-                classification_prompt, available_labels, email_content
+                classification_prompt,
+                available_labels,
+                email_content,
+                cache_control=self.prompt_cache_control,
             )
 
             # Call OpenRouter API (OpenAI-compatible)
@@ -88,17 +133,27 @@ class OpenRouterClassifier:
                 messages=messages,
                 temperature=self.temperature,
                 max_tokens=self.max_tokens,
+                **self._response_format(available_labels, batch=False),
             )
 
             # Extract text from response
             response_text = response.choices[0].message.content
+            self._log_prompt_cache_usage(response)
+            truncated = self._warn_if_truncated(response)
 
             # Parse the response using shared utility
             labels = parse_labels_from_response(response_text, available_labels)
+            if truncated and not labels:
+                # Not a real "no labels" answer; let the caller retry later
+                raise TruncatedResponseError(
+                    "Classification response was truncated before any labels"
+                )
 
             # Log result
             log_classification_result(email, labels, "OpenRouter")
 
+            self._cache_store(cache_keys, labels)
+
             return labels
 
         except ImportError:
@@ -106,6 +161,167 @@ class OpenRouterClassifier:
                 "openai package not installed. Install with: pip install openai"
             )
             return []
+        except TruncatedResponseError:
+            raise
         except Exception as e:
             logger.error(f"Error classifying email with OpenRouter: {e}", exc_info=True)
             return []
+
+    def classify_emails_batch(
+        self,
+        emails: List[Dict],
+        classification_prompt: str,
+        available_labels: List[str],
+    ) -> List[List[str]]:
+        """
+        Classify several emails with a single OpenRouter API call.
+
+        The instructions and labels are sent once for the whole batch
+        instead of once per email. Cached emails are answered without
+        being sent.
+
+        Args:
+            emails: Email dictionaries with subject, from, body fields
+            classification_prompt: The classification instructions
+            available_labels: List of available label names
+
+        Returns:
+            One list of applicable label names per email, in order
+
+        Raises:
+            TruncatedResponseError: If the reply hit max_tokens before every
+                sent email had labels
+        """
+        results: List[List[str]] = [[] for _ in emails]
+        try:
+            cache_keys = [None] * len(emails)
+            pending = []
+            for i, email in enumerate(emails):
+                cache_keys[i], cached_labels = self._cache_lookup(
+                    email, classification_prompt, available_labels
+                )
+                if cached_labels is not None:
+                    results[i] = cached_labels
+                else:
+                    pending.append(i)
+
+            if not pending:
+                return results
+
+            messages = build_batch_classification_messages(
+                classification_prompt,
+                available_labels,
+                [construct_email_content(emails[i]) for i in pending],
+                cache_control=self.prompt_cache_control,
+            )
+
+            # The response holds one entry per email; scale the budget
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens * len(pending),
+                **self._response_format(available_labels, batch=True),
+            )
+
+            response_text = response.choices[0].message.content
+            self._log_prompt_cache_usage(response)
+            truncated = self._warn_if_truncated(response)
+
+            batch_labels = parse_batch_labels_from_response(
+                response_text, available_labels, len(pending)
+            )
+
+            for i, labels in zip(pending, batch_labels):
+                log_classification_result(emails[i], labels, "OpenRouter batch")
+                self._cache_store(cache_keys[i], labels)
+                results[i] = labels
+
+            if truncated and not all(batch_labels):
+                # Labels that did parse are cached, so the retry is cheap
+                raise TruncatedResponseError(
+                    "Batch classification response was truncated before "
+                    "all emails had labels"
+                )
+
+            return results
+
+        except TruncatedResponseError:
+            raise
+        except Exception as e:
+            logger.error(
+                f"Error batch classifying emails with OpenRouter: {e}", exc_info=True
+            )
+            return results
+
+    def _cache_lookup(
+        self, email: Dict, classification_prompt: str, available_labels: List[str]
+    ) -> Tuple[Optional[Tuple], Optional[List[str]]]:
+        """
+        Look up an email's labels in the classification cache.
+
+        Args:
+            email: Email dictionary with subject, from, body fields
+            classification_prompt: The classification instructions
+            available_labels: List of available label names
+
+        Returns:
+            Tuple of (keys for storing a fresh result, cached labels or None);
+            the keys are None when caching is disabled
+        """
+        if self.cache is None:
+            return None, None
+
+        key = self.cache.make_key(
+            self.model, classification_prompt, available_labels, email
+        )
+        similarity_key = self.cache.make_similarity_key(
+            self.model, classification_prompt, available_labels, email
+        )
+        cached_labels = self.cache.lookup(key)
+        if cached_labels is None:
+            cached_labels = self.cache.lookup_similar(similarity_key)
+        if cached_labels is not None:
+            log_classification_result(email, cached_labels, "OpenRouter cache")
+        return (key, similarity_key), cached_labels
+
+    def _cache_store(self, cache_keys: Optional[Tuple], labels: List[str]):
+        """Cache a fresh classification under the keys from _cache_lookup."""
+        # Empty results may be transient failures; only cache real answers
+        if labels and cache_keys is not None:
+            key, similarity_key = cache_keys
+            self.cache.update(key, labels, similarity_key=similarity_key)
+
+    def _response_format(self, available_labels: List[str], batch: bool) -> Dict:
+        """Extra request parameters for structured output, if enabled."""
+        if not self.structured_output:
+            return {}
+        return {
+            "response_format": labels_response_format(tuple(available_labels), batch)
+        }
+
+    @staticmethod
+    def _warn_if_truncated(response) -> bool:
+        """Warn when the reply was cut off by the max_tokens limit."""
+        if response.choices[0].finish_reason == "length":
+            logger.warning(
+                "Classification response hit max_tokens and may be truncated; "
+                "consider raising max_tokens"
+            )
+            return True
+        return False
+
+    @staticmethod
+    def _log_prompt_cache_usage(response):
+        """Log how much of the prompt was served from the provider's cache."""
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None)
+        if isinstance(cached_tokens, int):
+            # Logged per response, so let logging skip formatting when
+            # debug output is off
+            logger.debug(
+                "Prompt cache: %s/%s prompt tokens read from cache",
+                cached_tokens,
+                usage.prompt_tokens,
+            )
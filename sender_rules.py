@@ -0,0 +1,98 @@
+"""
+Rules-based pre-filter that labels obvious emails without the LLM.
+
+Many emails are unambiguous from their sender or subject alone (e.g.
+anything from @github.com is "Github"). Rules from the optional "rules"
+field of classifier_config.json are compiled once and matched locally;
+only emails that match no rule are sent to OpenRouter.
+
+Rule format (label -> patterns):
+    "rules": {
+        "Github": {"from": ["@github.com"], "subject": ["^\\[GitHub\\]"]}
+    }
+- from: case-insensitive substrings of the From header
+- subject: case-insensitive regular expressions searched in the subject
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+RULE_FIELDS = ("from", "subject")
+
+
+def compile_rules(
+    rules: Dict[str, Dict[str, List[str]]],
+) -> List[Tuple[str, Optional[Pattern], Optional[Pattern]]]:
+    """
+    Compile rules into one from-pattern and one subject-pattern per label.
+
+    Args:
+        rules: Mapping of label name -> {"from": [...], "subject": [...]}
+
+    Returns:
+        List of (label, from pattern, subject pattern); a pattern is None
+        when the rule has no entries for that field
+
+    Raises:
+        ValueError: If a subject pattern is not a valid regular expression
+    """
+    compiled = []
+    for label, rule in rules.items():
+        senders = rule.get("from", [])
+        subjects = rule.get("subject", [])
+        from_pattern = (
+            re.compile("|".join(re.escape(s) for s in senders), re.IGNORECASE)
+            if senders
+            else None
+        )
+        try:
+            subject_pattern = (
+                re.compile("|".join(f"(?:{s})" for s in subjects), re.IGNORECASE)
+                if subjects
+                else None
+            )
+        except re.error as e:
+            raise ValueError(f"Invalid subject pattern in rule for '{label}': {e}")
+        compiled.append((label, from_pattern, subject_pattern))
+    return compiled
+
+
+class SenderRules:
+    """Match emails against compiled sender/subject rules."""
+
+    def __init__(self, rules: Dict[str, Dict[str, List[str]]]):
+        """
+        Args:
+            rules: Mapping of label name -> {"from": [...], "subject": [...]}
+        """
+        self._rules = compile_rules(rules)
+        self.checked = 0
+        self.matched = 0
+        logger.info(f"Loaded {len(self._rules)} sender rule(s)")
+
+    def match(self, email: Dict) -> List[str]:
+        """
+        Find the labels whose rules match an email.
+
+        Args:
+            email: Email dictionary with from and subject fields
+
+        Returns:
+            Matching label names in rule order (empty when no rule matches)
+        """
+        sender = email.get("from") or ""
+        subject = email.get("subject") or ""
+        labels = [
+            label
+            for label, from_pattern, subject_pattern in self._rules
+            if (from_pattern is not None and from_pattern.search(sender))
+            or (subject_pattern is not None and subject_pattern.search(subject))
+        ]
+
+        self.checked += 1
+        if labels:
+            self.matched += 1
+        return labels
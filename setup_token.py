@@ -9,7 +9,6 @@ Run this on a machine with a browser, then copy token.json to your server/contai
 import os
 import sys
 from pathlib import Path
-from gmail_client import GmailClient
 import config
 
 
@@ -49,6 +48,10 @@ def main():
     print()
 
     try:
+        # Imported here so the checks above don't wait on the Google API
+        # client libraries
+        from gmail_client import GmailClient
+
         # Initialize Gmail client (this will trigger OAuth flow)
         client = GmailClient(
             credentials_path=config.GMAIL_CREDENTIALS_PATH,
@@ -61,6 +64,9 @@ def main():
         print()
         print("Testing Gmail API connection...")
         messages = client.get_unread_messages(max_results=1)
+        if messages is None:
+            print("❌ Authenticated, but listing messages failed (see log above)")
+            return 1
         print(f"✓ Successfully connected to Gmail!")
         print(f"✓ Found {len(messages)} unread message(s)")
         print()
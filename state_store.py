@@ -1,37 +1,51 @@
 """
 Persistence for processed-email state.
 
-Stores a mapping of email ID -> ISO timestamp in a JSON file, with
-retention-based cleanup of old entries.
+Stores a mapping of email ID -> processed time (integer epoch seconds),
+with retention-based cleanup of old entries, as:
+1. A JSON snapshot (the state file), rewritten only on compaction.
+2. An append-only journal (<state file>.log) of "email_id<TAB>timestamp"
+   lines written since the snapshot, so marking an email processed costs
+   one short line rather than a rewrite of the whole state.
 """
 
 import json
 import logging
 import os
-from datetime import datetime, timedelta, timezone
-from typing import Dict
+import re
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, IO, Optional
 
 logger = logging.getLogger(__name__)
 
+# Journal timestamps are full-width epoch seconds (2001-2286); anything
+# shorter is a line torn mid-write
+_EPOCH_SECONDS = re.compile(r"\d{10}")
 
-def load_state(state_file: str, retention_days: int) -> Dict[str, str]:
+
+def load_state(state_file: str, retention_days: int) -> Dict[str, int]:
     """
-    Load processed email IDs with timestamps from state file.
+    Load processed email IDs with timestamps from state file and journal.
+
+    Older state files (a list of IDs, or ISO-8601 timestamps) are migrated
+    to epoch seconds on load.
 
     Args:
         state_file: Path to the JSON state file
         retention_days: Days to retain entries (<= 0 keeps all)
 
     Returns:
-        Dictionary mapping email IDs to ISO format timestamps
+        Dictionary mapping email IDs to epoch-second timestamps
     """
+    processed_emails = {}
     if not os.path.exists(state_file):
         logger.info(f"No state file found at {state_file}, starting fresh")
-        return {}
-
-    try:
-        with open(state_file, "r") as f:
-            state_data = json.load(f)
+    else:
+        try:
+            with open(state_file, "r") as f:
+                state_data = json.load(f)
             processed_emails_raw = state_data.get("processed_emails", {})
 
             # Handle migration from old format (list) to new format (dict)
@@ -40,33 +54,123 @@ def load_state(state_file: str, retention_days: int) -> Dict[str, str]:
                     "Migrating state from old format (list) to new format (dict)"
                 )
                 # Convert list to dict with current timestamp for all entries
-                current_time = datetime.now(timezone.utc).isoformat()
+                current_time = int(time.time())
                 processed_emails = {
                     email_id: current_time for email_id in processed_emails_raw
                 }
             else:
-                processed_emails = processed_emails_raw
+                processed_emails = _migrate_iso_timestamps(processed_emails_raw)
+        except Exception as e:
+            logger.error(f"Error loading state file {state_file}: {e}")
+            processed_emails = {}
 
-            # Cleanup old entries
-            processed_emails = cleanup_old_state(processed_emails, retention_days)
+    # Apply entries recorded since the snapshot was written
+    _replay_journal(journal_path(state_file), processed_emails)
 
-            logger.info(
-                f"Loaded {len(processed_emails)} processed email IDs from {state_file}"
-            )
-            return processed_emails
-    except Exception as e:
-        logger.error(f"Error loading state file {state_file}: {e}")
-        return {}
+    # Cleanup old entries
+    processed_emails = cleanup_old_state(processed_emails, retention_days)
+
+    logger.info(f"Loaded {len(processed_emails)} processed email IDs from {state_file}")
+    return processed_emails
+
+
+def journal_path(state_file: str) -> str:
+    """Path of the append-only journal that accompanies a state file."""
+    return f"{state_file}.log"
+
+
+def _replay_journal(path: str, processed_emails: Dict[str, int]):
+    """Apply journal lines to processed_emails in place."""
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                email_id, _, timestamp = line.rstrip("\n").partition("\t")
+                if email_id and _EPOCH_SECONDS.fullmatch(timestamp):
+                    processed_emails[email_id] = int(timestamp)
+                else:
+                    # A torn line from a crash mid-append
+                    logger.warning(f"Skipping malformed state journal line: {line!r}")
+    except OSError as e:
+        logger.error(f"Error reading state journal {path}: {e}")
+
+
+def open_journal(state_file: str) -> Optional[IO[str]]:
+    """
+    Open the state journal for appending.
+
+    Args:
+        state_file: Path to the JSON state file
+
+    Returns:
+        Open journal file, or None if it cannot be opened
+    """
+    path = journal_path(state_file)
+    try:
+        state_dir = os.path.dirname(path)
+        if state_dir and not os.path.exists(state_dir):
+            os.makedirs(state_dir, exist_ok=True)
+        _end_torn_line(path)
+        return open(path, "a", encoding="utf-8")
+    except OSError as e:
+        logger.error(f"Error opening state journal {path}: {e}")
+        return None
+
+
+def _end_torn_line(path: str):
+    """Terminate a partial final line so new appends start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            logger.warning(f"Terminating torn last line of state journal {path}")
+            f.write(b"\n")
+
+
+def append_journal(journal: IO[str], email_id: str, timestamp: int):
+    """
+    Record one processed email in the journal.
+
+    Args:
+        journal: Journal opened by open_journal
+        email_id: Processed email ID
+        timestamp: Epoch-second processed time
+    """
+    journal.write(f"{email_id}\t{timestamp}\n")
+
+
+def _migrate_iso_timestamps(processed_emails: Dict) -> Dict[str, int]:
+    """Convert ISO-8601 timestamps from older state files to epoch seconds."""
+    if all(isinstance(ts, int) for ts in processed_emails.values()):
+        return processed_emails
+
+    logger.info("Migrating state timestamps from ISO format to epoch seconds")
+    migrated = {}
+    for email_id, timestamp in processed_emails.items():
+        if isinstance(timestamp, int):
+            migrated[email_id] = timestamp
+            continue
+        try:
+            migrated[email_id] = int(datetime.fromisoformat(timestamp).timestamp())
+        except (ValueError, TypeError) as e:
+            # Invalid timestamp, skip this entry
+            logger.warning(f"Skipping entry with invalid timestamp: {email_id} - {e}")
+    return migrated
 
 
 def cleanup_old_state(
-    processed_emails: Dict[str, str], retention_days: int
-) -> Dict[str, str]:
+    processed_emails: Dict[str, int], retention_days: int
+) -> Dict[str, int]:
     """
     Remove entries older than retention period.
 
     Args:
-        processed_emails: Dictionary of email_id -> timestamp
+        processed_emails: Dictionary of email_id -> epoch-second timestamp
         retention_days: Days to retain entries (<= 0 keeps all)
 
     Returns:
@@ -76,21 +180,14 @@ def cleanup_old_state(
         # Retention disabled (keep all)
         return processed_emails
 
-    cutoff_date = datetime.now(timezone.utc) - timedelta(days=retention_days)
-    original_count = len(processed_emails)
+    cutoff = int(time.time()) - retention_days * 86400
+    cleaned = {
+        email_id: timestamp
+        for email_id, timestamp in processed_emails.items()
+        if timestamp >= cutoff
+    }
 
-    cleaned = {}
-    for email_id, timestamp_str in processed_emails.items():
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str)
-            if timestamp >= cutoff_date:
-                cleaned[email_id] = timestamp_str
-        except (ValueError, TypeError) as e:
-            # Invalid timestamp, skip this entry
-            logger.warning(f"Skipping entry with invalid timestamp: {email_id} - {e}")
-            continue
-
-    removed_count = original_count - len(cleaned)
+    removed_count = len(processed_emails) - len(cleaned)
     if removed_count > 0:
         logger.info(
             f"Removed {removed_count} email(s) older than {retention_days} days from state"
@@ -99,14 +196,21 @@ def cleanup_old_state(
     return cleaned
 
 
-def save_state(state_file: str, processed_emails: Dict[str, str]):
+def save_state(state_file: str, processed_emails: Dict[str, int]) -> bool:
     """
     Save processed email IDs with timestamps to state file.
 
+    The state is written to a temporary file in the same directory and
+    moved into place, so a crash mid-write never leaves a truncated file.
+
     Args:
         state_file: Path to the JSON state file
-        processed_emails: Dictionary of email_id -> timestamp
+        processed_emails: Dictionary of email_id -> epoch-second timestamp
+
+    Returns:
+        True if the state was written
     """
+    tmp_path = None
     try:
         # Ensure directory exists
         state_dir = os.path.dirname(state_file)
@@ -114,8 +218,16 @@ def save_state(state_file: str, processed_emails: Dict[str, str]):
             os.makedirs(state_dir, exist_ok=True)
 
         state_data = {"processed_emails": processed_emails}
-        with open(state_file, "w") as f:
-            json.dump(state_data, f, indent=2)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=state_dir or ".", suffix=".tmp", delete=False
+        ) as f:
+            tmp_path = f.name
+            json.dump(state_data, f, separators=(",", ":"))
+        os.replace(tmp_path, state_file)
         logger.debug(f"State saved to {state_file}")
+        return True
     except Exception as e:
         logger.error(f"Error saving state file {state_file}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
@@ -5,8 +5,9 @@ Shared test fixtures and configurations for pytest.
 import pytest
 import json
 import os
+import shutil
+import tempfile
 from typing import Dict, List
-from unittest.mock import Mock
 
 # Sample test data
 TEST_EMAIL = {
@@ -23,41 +24,41 @@ TEST_CLASSIFICATION_PROMPT = """Classify this email into one or more categories.
 Consider the sender, subject, and content to determine the most appropriate labels."""
 
 
-# Global flag to track if we created the config file
-_created_test_config = False
+# Temporary directory holding the test classifier_config.json
+_test_config_dir = None
 
 
 def pytest_configure(config):
     """
-    Create classifier_config.json before test collection.
+    Point the config module at a test classifier_config.json.
 
-    This runs before pytest starts collecting tests, ensuring the config
-    module can import successfully in CI environments where
-    classifier_config.json doesn't exist.
+    This runs before pytest starts collecting tests, so the config module
+    imports successfully in CI environments where classifier_config.json
+    doesn't exist. The file lives in its own temporary directory, so the
+    working directory is never touched and concurrent runs don't collide.
     """
-    global _created_test_config
-    config_path = "classifier_config.json"
+    global _test_config_dir
+    _test_config_dir = tempfile.mkdtemp(prefix="gmailclassifier-tests-")
+    config_path = os.path.join(_test_config_dir, "classifier_config.json")
 
-    if not os.path.exists(config_path):
-        test_config = {
-            "labels": TEST_LABELS,
-            "classification_prompt": TEST_CLASSIFICATION_PROMPT,
-        }
-        with open(config_path, "w") as f:
-            json.dump(test_config, f, indent=2)
-        _created_test_config = True
+    test_config = {
+        "labels": TEST_LABELS,
+        "classification_prompt": TEST_CLASSIFICATION_PROMPT,
+    }
+    with open(config_path, "w") as f:
+        json.dump(test_config, f, indent=2)
+    os.environ["CLASSIFIER_CONFIG_PATH"] = config_path
 
 
 def pytest_unconfigure(config):
     """
-    Cleanup: remove test classifier_config.json if we created it.
+    Cleanup: remove the temporary test config directory.
     """
-    global _created_test_config
-    config_path = "classifier_config.json"
-
-    if _created_test_config and os.path.exists(config_path):
-        os.unlink(config_path)
-        _created_test_config = False
+    global _test_config_dir
+    if _test_config_dir is not None:
+        shutil.rmtree(_test_config_dir, ignore_errors=True)
+        os.environ.pop("CLASSIFIER_CONFIG_PATH", None)
+        _test_config_dir = None
 
 
 @pytest.fixture
@@ -76,88 +77,3 @@ def test_labels() -> List[str]:
 def classification_prompt() -> str:
     """Sample classification prompt."""
     return TEST_CLASSIFICATION_PROMPT
-
-
-# Mock responses for each provider
-class MockResponses:
-    """Mock LLM API responses."""
-
-    @staticmethod
-    def bedrock_success() -> Dict:
-        """Mock successful Bedrock response."""
-        return {
-            "body": Mock(
-                read=lambda: b'{"content": [{"text": "{\\"labels\\": [\\"AWS\\", \\"Finance\\"]}"}]}'
-            )
-        }
-
-    @staticmethod
-    def anthropic_success() -> Mock:
-        """Mock successful Anthropic response."""
-        response = Mock()
-        content_block = Mock()
-        content_block.text = '{"labels": ["AWS", "Finance"]}'
-        response.content = [content_block]
-        return response
-
-    @staticmethod
-    def openai_success() -> Mock:
-        """Mock successful OpenAI response."""
-        response = Mock()
-        choice = Mock()
-        message = Mock()
-        message.content = '{"labels": ["AWS", "Finance"]}'
-        choice.message = message
-        response.choices = [choice]
-        return response
-
-    @staticmethod
-    def ollama_success() -> Dict:
-        """Mock successful Ollama response."""
-        return {"message": {"content": '{"labels": ["AWS", "Finance"]}'}}
-
-    @staticmethod
-    def response_with_markdown() -> str:
-        """Mock response with markdown code block."""
-        return """```json
-{"labels": ["AWS", "Finance"]}
-```"""
-
-    @staticmethod
-    def response_with_text() -> str:
-        """Mock response with extra text."""
-        return 'Based on the email content: {"labels": ["AWS", "Finance"]}'
-
-    @staticmethod
-    def response_invalid_json() -> str:
-        """Mock response with invalid JSON."""
-        return '{"labels": ["AWS", "Finance"'
-
-    @staticmethod
-    def response_invalid_labels() -> str:
-        """Mock response with invalid labels."""
-        return '{"labels": ["AWS", "InvalidLabel", "Finance"]}'
-
-
-@pytest.fixture
-def mock_responses():
-    """Fixture providing mock responses."""
-    return MockResponses
-
-
-@pytest.fixture
-def mock_config():
-    """Mock config module."""
-    config = Mock()
-    config.LLM_PROVIDER = "bedrock"
-    config.AWS_REGION = "us-east-1"
-    config.AWS_ACCESS_KEY_ID = None
-    config.AWS_SECRET_ACCESS_KEY = None
-    config.BEDROCK_MODEL_ID = "us.anthropic.claude-sonnet-4-5-20250929-v1:0"
-    config.ANTHROPIC_API_KEY = "test-key"
-    config.ANTHROPIC_MODEL = "claude-3-5-sonnet-20241022"
-    config.OPENAI_API_KEY = "test-key"
-    config.OPENAI_MODEL = "gpt-4-turbo"
-    config.OLLAMA_MODEL = "llama3"
-    config.OLLAMA_BASE_URL = "http://localhost:11434"
-    return config
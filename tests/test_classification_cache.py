@@ -0,0 +1,198 @@
+"""
+Unit tests for classification_cache.py
+"""
+
+import time
+from unittest.mock import patch
+
+import pytest
+
+from classification_cache import ClassificationCache, normalize_text, simhash
+
+EMAIL = {
+    "subject": "Your order has shipped",
+    "from": "orders@shop.example",
+    "body": "Track it at https://shop.example/t/abc123",
+}
+
+
+def _key(email=EMAIL, model="m", prompt="p", labels=("Shipping", "Work")):
+    return ClassificationCache.make_key(model, prompt, list(labels), email)
+
+
+@pytest.mark.unit
+class TestNormalizeText:
+    def test_strips_urls_quotes_and_whitespace(self):
+        text = "Hello   World\n> quoted reply\nSee https://x.example/abc?t=1 now"
+        assert normalize_text(text) == "hello world see now"
+
+    def test_none_is_empty(self):
+        assert normalize_text(None) == ""
+
+
+@pytest.mark.unit
+class TestMakeKey:
+    def test_near_duplicates_collide(self):
+        variant = dict(EMAIL, body="Track it at  https://shop.example/t/zzz999 ")
+        assert _key(EMAIL) == _key(variant)
+
+    def test_label_order_does_not_matter(self):
+        assert _key(labels=("Work", "Shipping")) == _key(labels=("Shipping", "Work"))
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {"model": "other-model"},
+            {"prompt": "other prompt"},
+            {"labels": ("Shipping",)},
+            {"email": dict(EMAIL, subject="Your order was cancelled")},
+        ],
+    )
+    def test_inputs_change_key(self, kwargs):
+        assert _key(**kwargs) != _key()
+
+
+@pytest.mark.unit
+class TestMemoryTier:
+    def test_miss_then_hit(self):
+        cache = ClassificationCache()
+        assert cache.lookup("k") is None
+        cache.update("k", ["Shipping"])
+        assert cache.lookup("k") == ["Shipping"]
+
+    def test_lru_eviction(self):
+        cache = ClassificationCache(max_entries=2)
+        cache.update("a", ["A"])
+        cache.update("b", ["B"])
+        cache.lookup("a")  # "b" is now least recently used
+        cache.update("c", ["C"])
+
+        assert cache.lookup("a") == ["A"]
+        assert cache.lookup("b") is None
+        assert cache.lookup("c") == ["C"]
+
+    def test_expired_entries_miss(self):
+        cache = ClassificationCache(ttl_days=1)
+        cache.update("k", ["Shipping"])
+        with patch(
+            "classification_cache.time.time", return_value=time.time() + 2 * 86400
+        ):
+            assert cache.lookup("k") is None
+
+    def test_returned_list_is_a_copy(self):
+        cache = ClassificationCache()
+        cache.update("k", ["Shipping"])
+        cache.lookup("k").append("Mutated")
+        assert cache.lookup("k") == ["Shipping"]
+
+
+@pytest.mark.unit
+class TestSqliteTier:
+    def test_persists_across_instances(self, tmp_path):
+        db = str(tmp_path / "cache.db")
+        ClassificationCache(db_path=db).update("k", ["Shipping", "Work"])
+
+        assert ClassificationCache(db_path=db).lookup("k") == ["Shipping", "Work"]
+
+    def test_expired_rows_purged_on_open(self, tmp_path):
+        db = str(tmp_path / "cache.db")
+        with patch("classification_cache.time.time", return_value=1000.0):
+            ClassificationCache(db_path=db, ttl_days=1).update("k", ["Shipping"])
+
+        cache = ClassificationCache(db_path=db, ttl_days=1)
+        assert cache._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0
+        assert cache.lookup("k") is None
+
+    @pytest.mark.parametrize("stored", ["not json", '"Shipping"', "null"])
+    def test_corrupt_row_is_a_miss_and_removed(self, tmp_path, stored):
+        db = str(tmp_path / "cache.db")
+        ClassificationCache(db_path=db).update("k", ["Shipping"])
+        cache = ClassificationCache(db_path=db)
+        cache._db.execute("UPDATE cache SET labels = ? WHERE key = 'k'", (stored,))
+        cache._db.commit()
+
+        assert cache.lookup("k") is None
+        assert cache._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] == 0
+
+    def test_unopenable_db_falls_back_to_memory(self, tmp_path):
+        cache = ClassificationCache(db_path=str(tmp_path / "missing" / "cache.db"))
+
+        assert cache._db is None
+        cache.update("k", ["Shipping"])
+        assert cache.lookup("k") == ["Shipping"]
+
+
+RECEIPT = (
+    "Thanks for your purchase. Your order number {} has been confirmed and "
+    "will ship within two business days. You can review the items, the "
+    "delivery address, and the payment method in your account at any time. "
+    "If you have questions about your order, reply to this email or contact "
+    "our support team, who are available seven days a week. We hope you enjoy "
+    "your purchase and look forward to serving you again soon."
+)
+
+
+def _receipt(order, sender="orders@shop.example"):
+    return {
+        "subject": f"Order {order} confirmed",
+        "from": sender,
+        "body": RECEIPT.format(order),
+    }
+
+
+def _similarity_key(cache, email):
+    return cache.make_similarity_key("m", "p", ["Shipping", "Work"], email)
+
+
+@pytest.mark.unit
+class TestSimhash:
+    def test_numbers_are_masked(self):
+        assert simhash(RECEIPT.format("1001")) == simhash(RECEIPT.format("2002"))
+
+    def test_near_identical_texts_are_close(self):
+        distance = bin(simhash(RECEIPT) ^ simhash(RECEIPT + " Happy shopping!")).count(
+            "1"
+        )
+        assert distance <= ClassificationCache.SIMILAR_MAX_DISTANCE
+
+    def test_different_texts_are_far(self):
+        other = "Can we move tomorrow's standup to the afternoon? Thanks, Sam"
+        distance = bin(simhash(RECEIPT.format("1001")) ^ simhash(other)).count("1")
+        assert distance > ClassificationCache.SIMILAR_MAX_DISTANCE
+
+    def test_empty_text(self):
+        assert simhash(None) == simhash("") == 0
+
+
+@pytest.mark.unit
+class TestNearDuplicateTier:
+    def test_disabled_by_default(self):
+        cache = ClassificationCache()
+
+        assert _similarity_key(cache, _receipt("1001")) is None
+        assert cache.lookup_similar(None) is None
+
+    def test_templated_email_hits(self):
+        cache = ClassificationCache(near_duplicates=True)
+        first = _receipt("1001")
+        cache.update(_key(first), ["Shipping"], _similarity_key(cache, first))
+
+        second = _receipt("2002")
+        assert cache.lookup(_key(second)) is None
+        assert cache.lookup_similar(_similarity_key(cache, second)) == ["Shipping"]
+
+    def test_other_sender_domain_misses(self):
+        cache = ClassificationCache(near_duplicates=True)
+        first = _receipt("1001")
+        cache.update(_key(first), ["Shipping"], _similarity_key(cache, first))
+
+        spoof = _receipt("2002", sender="orders@sh0p.example")
+        assert cache.lookup_similar(_similarity_key(cache, spoof)) is None
+
+    def test_expired_entries_miss(self):
+        cache = ClassificationCache(ttl_days=1, near_duplicates=True)
+        first = _receipt("1001")
+        with patch("classification_cache.time.time", return_value=0):
+            cache.update(_key(first), ["Shipping"], _similarity_key(cache, first))
+
+        assert cache.lookup_similar(_similarity_key(cache, _receipt("2002"))) is None
@@ -2,7 +2,10 @@
 Tests for config.py - configuration loading and validation.
 """
 
+import importlib
 import json
+from unittest.mock import patch
+
 import pytest
 
 
@@ -40,166 +43,38 @@ class TestLoadModelConfig:
         assert "Model config file not found" in str(exc_info.value)
         assert "model_config.example.json" in str(exc_info.value)
 
-    def test_missing_model_field(self, tmp_path):
-        """Test error when 'model' field is missing."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {"temperature": 0.0, "max_tokens": 1000}
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "must contain 'model' field" in str(exc_info.value)
-
-    def test_missing_temperature_field(self, tmp_path):
-        """Test error when 'temperature' field is missing."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "max_tokens": 1000,
-        }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "must contain 'temperature' field" in str(exc_info.value)
-
-    def test_missing_max_tokens_field(self, tmp_path):
-        """Test error when 'max_tokens' field is missing."""
-        config_file = tmp_path / "model_config.json"
+    @pytest.mark.parametrize(
+        "overrides,message",
+        [
+            ({"model": None}, "must contain 'model' field"),
+            ({"temperature": None}, "must contain 'temperature' field"),
+            ({"max_tokens": None}, "must contain 'max_tokens' field"),
+            ({"model": 123}, "'model' must be a string"),
+            ({"temperature": "not_a_number"}, "'temperature' must be a number"),
+            ({"max_tokens": "not_an_int"}, "'max_tokens' must be an integer"),
+            ({"temperature": 2.5}, "'temperature' must be between 0 and 2"),
+            ({"temperature": -0.1}, "'temperature' must be between 0 and 2"),
+            ({"max_tokens": 0}, "'max_tokens' must be greater than 0"),
+            ({"max_tokens": -100}, "'max_tokens' must be greater than 0"),
+        ],
+    )
+    def test_invalid_config(self, tmp_path, overrides, message):
+        """Test errors for missing or invalid fields (None removes the field)."""
         config_data = {
             "model": "anthropic/claude-3.5-sonnet",
             "temperature": 0.0,
-        }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "must contain 'max_tokens' field" in str(exc_info.value)
-
-    def test_invalid_model_type(self, tmp_path):
-        """Test error when 'model' is not a string."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {"model": 123, "temperature": 0.0, "max_tokens": 1000}
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "'model' must be a string" in str(exc_info.value)
-
-    def test_invalid_temperature_type(self, tmp_path):
-        """Test error when 'temperature' is not a number."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "temperature": "not_a_number",
             "max_tokens": 1000,
         }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "'temperature' must be a number" in str(exc_info.value)
-
-    def test_invalid_max_tokens_type(self, tmp_path):
-        """Test error when 'max_tokens' is not an integer."""
+        config_data.update(overrides)
+        config_data = {k: v for k, v in config_data.items() if v is not None}
         config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "temperature": 0.0,
-            "max_tokens": "not_an_int",
-        }
         config_file.write_text(json.dumps(config_data))
 
         from config import load_model_config
 
-        with pytest.raises(ValueError) as exc_info:
+        with pytest.raises(ValueError, match=message):
             load_model_config(str(config_file))
 
-        assert "'max_tokens' must be an integer" in str(exc_info.value)
-
-    def test_temperature_out_of_range_high(self, tmp_path):
-        """Test error when temperature is above 2.0."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "temperature": 2.5,
-            "max_tokens": 1000,
-        }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "'temperature' must be between 0 and 2" in str(exc_info.value)
-
-    def test_temperature_out_of_range_low(self, tmp_path):
-        """Test error when temperature is below 0.0."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "temperature": -0.1,
-            "max_tokens": 1000,
-        }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "'temperature' must be between 0 and 2" in str(exc_info.value)
-
-    def test_max_tokens_zero(self, tmp_path):
-        """Test error when max_tokens is 0."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "temperature": 0.0,
-            "max_tokens": 0,
-        }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "'max_tokens' must be greater than 0" in str(exc_info.value)
-
-    def test_max_tokens_negative(self, tmp_path):
-        """Test error when max_tokens is negative."""
-        config_file = tmp_path / "model_config.json"
-        config_data = {
-            "model": "anthropic/claude-3.5-sonnet",
-            "temperature": 0.0,
-            "max_tokens": -100,
-        }
-        config_file.write_text(json.dumps(config_data))
-
-        from config import load_model_config
-
-        with pytest.raises(ValueError) as exc_info:
-            load_model_config(str(config_file))
-
-        assert "'max_tokens' must be greater than 0" in str(exc_info.value)
-
     def test_invalid_json(self, tmp_path):
         """Test error when config file contains invalid JSON."""
         config_file = tmp_path / "model_config.json"
@@ -241,3 +116,79 @@ class TestLoadModelConfig:
 
         result = load_model_config(str(config_file))
         assert result["temperature"] == 1
+
+
+@pytest.mark.unit
+class TestLoadClassifierConfigRules:
+    """Tests for the optional 'rules' field of the classifier config."""
+
+    def _write(self, tmp_path, rules):
+        config_file = tmp_path / "classifier_config.json"
+        config_file.write_text(
+            json.dumps(
+                {
+                    "labels": ["Github", "AWS"],
+                    "classification_prompt": "Classify",
+                    "rules": rules,
+                }
+            )
+        )
+        return str(config_file)
+
+    def test_valid_rules(self, tmp_path):
+        from config import load_classifier_config
+
+        rules = {"Github": {"from": ["@github.com"], "subject": [r"^\[GitHub\]"]}}
+        result = load_classifier_config(self._write(tmp_path, rules))
+
+        assert result["rules"] == rules
+
+    def test_rules_optional(self, tmp_path):
+        from config import load_classifier_config
+
+        config_file = tmp_path / "classifier_config.json"
+        config_file.write_text(
+            json.dumps({"labels": ["Github"], "classification_prompt": "Classify"})
+        )
+
+        assert "rules" not in load_classifier_config(str(config_file))
+
+    @pytest.mark.parametrize(
+        "rules,message",
+        [
+            ([], "'rules' must be an object"),
+            ({"Unknown": {"from": ["x"]}}, "not in 'labels'"),
+            ({"Github": {"body": ["x"]}}, "'from' and/or 'subject'"),
+            ({"Github": {"from": "@github.com"}}, "list of non-empty strings"),
+            ({"Github": {"from": [""]}}, "list of non-empty strings"),
+            ({"Github": {"subject": ["("]}}, "Invalid subject pattern"),
+        ],
+    )
+    def test_invalid_rules(self, tmp_path, rules, message):
+        from config import load_classifier_config
+
+        with pytest.raises(ValueError, match=message):
+            load_classifier_config(self._write(tmp_path, rules))
+
+
+@pytest.mark.unit
+class TestSkipDotenv:
+    """Tests for the SKIP_DOTENV switch."""
+
+    def _reload_config(self):
+        import config
+
+        with patch("dotenv.load_dotenv") as load_dotenv:
+            importlib.reload(config)
+        importlib.reload(config)
+        return load_dotenv
+
+    def test_dotenv_loaded_by_default(self, monkeypatch):
+        monkeypatch.delenv("SKIP_DOTENV", raising=False)
+
+        self._reload_config().assert_called_once()
+
+    def test_skip_dotenv_skips_loading(self, monkeypatch):
+        monkeypatch.setenv("SKIP_DOTENV", "true")
+
+        self._reload_config().assert_not_called()
@@ -5,21 +5,65 @@ Unit tests for EmailClassifierAgent with state tracking.
 import json
 import os
 import tempfile
+import time
 import pytest
-from datetime import timezone
+from pathlib import Path
+from types import MappingProxyType
+from datetime import datetime, timedelta, timezone
 from unittest.mock import Mock, patch
+from freezegun import freeze_time
 from email_classifier_agent import EmailClassifierAgent
+from gmail_client import GmailClient
+from openrouter_classifier import OpenRouterClassifier, TruncatedResponseError
+import state_store
 
 
 @pytest.fixture
-def temp_state_file():
-    """Create a temporary state file for testing."""
-    with tempfile.NamedTemporaryFile(mode="w", delete=False, suffix=".json") as f:
-        temp_path = f.name
-    yield temp_path
-    # Cleanup
-    if os.path.exists(temp_path):
-        os.unlink(temp_path)
+def temp_state_file(tmp_path):
+    """Path for a state file (and its journal) in a per-test directory."""
+    return str(tmp_path / "state.json")
+
+
+@pytest.fixture(scope="module")
+def sample_email():
+    """A read-only email shared by the tests in this module."""
+    return MappingProxyType(
+        {
+            "id": "test_email_123",
+            "subject": "Test Email",
+            "from": "test@example.com",
+            "body": "Test body",
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def sample_emails_batch():
+    """Five distinct read-only emails shared by the tests in this module."""
+    return tuple(
+        MappingProxyType(
+            {
+                "id": f"email_{i}",
+                "subject": f"Email {i}",
+                "from": "test@example.com",
+                "body": "Test",
+            }
+        )
+        for i in range(5)
+    )
+
+
+@pytest.fixture
+def mutable_sample_email(sample_email):
+    """A per-test copy of sample_email for tests that modify it."""
+    return dict(sample_email)
+
+
+@pytest.fixture
+def now_utc():
+    """A frozen current UTC time shared by the test and the code under test."""
+    with freeze_time("2026-01-15 12:00:00"):
+        yield datetime.now(timezone.utc)
 
 
 @pytest.fixture
@@ -37,6 +81,10 @@ def mock_config_with_state(temp_state_file):
         mock_config.LABELS = ["AWS", "Github", "Shipping"]
         mock_config.CLASSIFICATION_PROMPT = "Test classification prompt for unit tests"
         mock_config.REMOVE_FROM_INBOX = True
+        mock_config.LLM_CONCURRENCY = 4
+        mock_config.CLASSIFY_BATCH_SIZE = 1
+        mock_config.RULES = {}
+        mock_config.CLASSIFICATION_CACHE_ENABLED = False
         mock_config.INJECTION_GUARD_ENABLED = False
         mock_config.INJECTION_QUARANTINE_LABEL = "Suspicious"
         mock_config.INJECTION_ML_ENABLED = False
@@ -49,11 +97,15 @@ def mock_config_with_state(temp_state_file):
 def mock_gmail_client():
     """Mock Gmail client."""
     with patch("email_classifier_agent.GmailClient") as mock:
-        client = Mock()
+        # spec_set rejects attributes GmailClient doesn't define
+        client = Mock(spec_set=GmailClient)
         client.create_label_if_not_exists = Mock(
             side_effect=lambda label: f"label_id_{label}"
         )
         client.add_labels_to_message = Mock()
+        client.batch_apply_labels = Mock(
+            side_effect=lambda groups, **kwargs: sum(groups.values(), [])
+        )
         mock.return_value = client
         yield client
 
@@ -62,7 +114,7 @@ def mock_gmail_client():
 def mock_llm_provider():
     """Mock OpenRouter classifier."""
     with patch("email_classifier_agent.OpenRouterClassifier") as mock:
-        classifier = Mock()
+        classifier = Mock(spec_set=OpenRouterClassifier)
         classifier.classify_email = Mock(return_value=["AWS", "Github"])
         mock.return_value = classifier
         yield classifier
@@ -86,8 +138,7 @@ class TestEmailClassifierAgentStateTracking:
         """Test loading state from existing file."""
         # Create state file with some processed emails
         state_data = {"processed_emails": ["email1", "email2", "email3"]}
-        with open(mock_config_with_state.STATE_FILE, "w") as f:
-            json.dump(state_data, f)
+        Path(mock_config_with_state.STATE_FILE).write_text(json.dumps(state_data))
 
         agent = EmailClassifierAgent()
         assert len(agent.processed_emails) == 3
@@ -100,8 +151,7 @@ class TestEmailClassifierAgentStateTracking:
     ):
         """Test loading state from corrupted file."""
         # Write invalid JSON
-        with open(mock_config_with_state.STATE_FILE, "w") as f:
-            f.write("invalid json{{{")
+        Path(mock_config_with_state.STATE_FILE).write_text("invalid json{{{")
 
         agent = EmailClassifierAgent()
         # Should gracefully handle error and return empty set
@@ -111,18 +161,15 @@ class TestEmailClassifierAgentStateTracking:
         self, mock_config_with_state, mock_gmail_client, mock_llm_provider
     ):
         """Test saving state to file."""
-        from datetime import datetime
-
         agent = EmailClassifierAgent()
-        timestamp1 = datetime.now(timezone.utc).isoformat()
-        timestamp2 = datetime.now(timezone.utc).isoformat()
+        timestamp1 = int(time.time())
+        timestamp2 = int(time.time())
         agent.processed_emails["email1"] = timestamp1
         agent.processed_emails["email2"] = timestamp2
         agent._save_state()
 
         # Verify state file contents
-        with open(mock_config_with_state.STATE_FILE, "r") as f:
-            state_data = json.load(f)
+        state_data = json.loads(Path(mock_config_with_state.STATE_FILE).read_text())
         assert "email1" in state_data["processed_emails"]
         assert "email2" in state_data["processed_emails"]
         assert isinstance(state_data["processed_emails"], dict)
@@ -131,58 +178,151 @@ class TestEmailClassifierAgentStateTracking:
         self, mock_config_with_state, mock_gmail_client, mock_llm_provider
     ):
         """Test that save_state creates directory if it doesn't exist."""
-        from datetime import datetime
-
         # Use a state file in a non-existent directory
         with tempfile.TemporaryDirectory() as tmpdir:
             state_path = os.path.join(tmpdir, "subdir", "state.json")
             mock_config_with_state.STATE_FILE = state_path
 
             agent = EmailClassifierAgent()
-            agent.processed_emails["email1"] = datetime.now(timezone.utc).isoformat()
+            agent.processed_emails["email1"] = int(time.time())
             agent._save_state()
 
             assert os.path.exists(state_path)
-            with open(state_path, "r") as f:
-                state_data = json.load(f)
+            state_data = json.loads(Path(state_path).read_text())
             assert "email1" in state_data["processed_emails"]
 
     def test_process_email_saves_state(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
     ):
         """Test that processing an email saves it to state."""
         agent = EmailClassifierAgent()
 
-        email = {
-            "id": "test_email_123",
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
-        }
+        email = sample_email
 
         result = agent.process_email(email)
 
         assert result is True
-        assert "test_email_123" in agent.processed_emails
+        assert email["id"] in agent.processed_emails
 
         # Verify state was saved to disk
-        with open(mock_config_with_state.STATE_FILE, "r") as f:
-            state_data = json.load(f)
-        assert "test_email_123" in state_data["processed_emails"]
+        saved = state_store.load_state(mock_config_with_state.STATE_FILE, 30)
+        assert email["id"] in saved
 
-    def test_process_email_skips_already_processed(
+    def test_save_state_is_atomic(
         self, mock_config_with_state, mock_gmail_client, mock_llm_provider
     ):
-        """Test that already-processed emails are skipped."""
+        """Test that a failed write leaves the previous state file intact."""
         agent = EmailClassifierAgent()
+        agent.processed_emails["email1"] = 1767225600
+        agent._save_state()
 
-        email = {
-            "id": "test_email_123",
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
+        agent.processed_emails["email2"] = 1767225600
+        with patch("state_store.json.dump", side_effect=OSError("disk full")):
+            agent._save_state()
+
+        state_data = json.loads(Path(mock_config_with_state.STATE_FILE).read_text())
+        assert list(state_data["processed_emails"]) == ["email1"]
+        state_dir = os.path.dirname(mock_config_with_state.STATE_FILE)
+        assert not [n for n in os.listdir(state_dir) if n.endswith(".tmp")]
+
+    def test_processed_emails_appended_to_journal(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        """Test that a batch appends journal lines instead of a full rewrite."""
+        agent = EmailClassifierAgent()
+        emails = [
+            {"id": f"email_{i}", "subject": "Test", "from": "a@b.c", "body": "x"}
+            for i in range(5)
+        ]
+
+        with patch("state_store.save_state") as save_state:
+            assert agent.process_emails(emails) == 5
+
+        save_state.assert_not_called()
+        journal = state_store.journal_path(mock_config_with_state.STATE_FILE)
+        lines = Path(journal).read_text().splitlines()
+        assert [line.split("\t")[0] for line in lines] == [e["id"] for e in emails]
+
+    def test_journal_compacted_into_snapshot(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        """Test that the journal is folded into the snapshot periodically."""
+        agent = EmailClassifierAgent()
+        agent.STATE_COMPACT_EVERY = 2
+        emails = [
+            {"id": f"email_{i}", "subject": "Test", "from": "a@b.c", "body": "x"}
+            for i in range(5)
+        ]
+
+        agent.process_emails(emails)
+
+        state_data = json.loads(Path(mock_config_with_state.STATE_FILE).read_text())
+        snapshot = state_data["processed_emails"]
+        journal = state_store.journal_path(mock_config_with_state.STATE_FILE)
+        journal_ids = [
+            line.split("\t")[0] for line in Path(journal).read_text().splitlines()
+        ]
+        assert sorted(snapshot) == [f"email_{i}" for i in range(4)]
+        assert journal_ids == ["email_4"]
+        assert len(state_store.load_state(mock_config_with_state.STATE_FILE, 30)) == 5
+
+    def test_journal_compacted_on_restart(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, now_utc
+    ):
+        """Test that a restart folds the old journal into the snapshot."""
+        state_file = mock_config_with_state.STATE_FILE
+        journal = state_store.journal_path(state_file)
+        now = int(now_utc.timestamp())
+        expired = now - 31 * 86400
+        Path(state_file).write_text(
+            json.dumps({"processed_emails": {"old_email": expired}})
+        )
+        Path(journal).write_text(f"email_1\t{now}\nemail_2\t{now}\n")
+
+        agent = EmailClassifierAgent()
+
+        snapshot = json.loads(Path(state_file).read_text())["processed_emails"]
+        assert snapshot == {"email_1": now, "email_2": now}
+        assert Path(journal).read_text() == ""
+        assert agent._unsaved == 0
+
+        # Later appends still land in the emptied journal
+        agent._mark_processed("email_3")
+        agent._maybe_flush(force=True)
+        agent._journal.close()
+        assert set(state_store.load_state(state_file, 30)) == {
+            "email_1",
+            "email_2",
+            "email_3",
         }
 
+    def test_torn_journal_line_ignored(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        """Test that a partially written journal line is skipped on load."""
+        journal = state_store.journal_path(mock_config_with_state.STATE_FILE)
+        now = int(time.time())
+        Path(journal).write_text(f"email_1\t{now}\nemail_2\t{now}\nemail_3\t17")
+
+        agent = EmailClassifierAgent()
+        assert set(agent.processed_emails) == {"email_1", "email_2"}
+
+        # Appends after the torn line survive the next load
+        agent._mark_processed("email_4")
+        agent._maybe_flush(force=True)
+        agent._journal.close()
+
+        reloaded = state_store.load_state(mock_config_with_state.STATE_FILE, 30)
+        assert set(reloaded) == {"email_1", "email_2", "email_4"}
+
+    def test_process_email_skips_already_processed(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
+    ):
+        """Test that already-processed emails are skipped."""
+        agent = EmailClassifierAgent()
+
+        email = sample_email
+
         # Process email first time
         agent.process_email(email)
         assert mock_llm_provider.classify_email.call_count == 1
@@ -193,42 +333,38 @@ class TestEmailClassifierAgentStateTracking:
         # Should skip LLM call
         assert mock_llm_provider.classify_email.call_count == 1
         assert result is True
-        assert "test_email_123" in agent.processed_emails
+        assert email["id"] in agent.processed_emails
 
     def test_process_email_no_id(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self,
+        mock_config_with_state,
+        mock_gmail_client,
+        mock_llm_provider,
+        mutable_sample_email,
     ):
         """Test processing email without ID field."""
         agent = EmailClassifierAgent()
 
-        email = {
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
-        }
+        email = mutable_sample_email
+        del email["id"]
 
         result = agent.process_email(email)
         assert result is False
 
     def test_process_email_no_labels_still_saves_state(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
     ):
         """Test that emails with no labels are still marked as processed."""
         agent = EmailClassifierAgent()
         mock_llm_provider.classify_email.return_value = []
 
-        email = {
-            "id": "test_email_456",
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
-        }
+        email = sample_email
 
         result = agent.process_email(email)
 
         # Should return False but still mark as processed
         assert result is False
-        assert "test_email_456" in agent.processed_emails
+        assert email["id"] in agent.processed_emails
 
         # Should not retry on next poll
         result2 = agent.process_email(email)
@@ -236,22 +372,17 @@ class TestEmailClassifierAgentStateTracking:
         assert mock_llm_provider.classify_email.call_count == 1
 
     def test_state_persistence_across_restarts(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
     ):
         """Test that state persists across agent restarts."""
         # First agent instance processes an email
         agent1 = EmailClassifierAgent()
-        email = {
-            "id": "test_email_789",
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
-        }
+        email = sample_email
         agent1.process_email(email)
 
         # Second agent instance should load the state
         agent2 = EmailClassifierAgent()
-        assert "test_email_789" in agent2.processed_emails
+        assert email["id"] in agent2.processed_emails
 
         # Should skip already-processed email
         result = agent2.process_email(email)
@@ -260,43 +391,46 @@ class TestEmailClassifierAgentStateTracking:
         assert mock_llm_provider.classify_email.call_count == 1
 
     def test_process_email_exception_does_not_save_state(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
     ):
         """Test that failed email processing doesn't save to state."""
         agent = EmailClassifierAgent()
         mock_llm_provider.classify_email.side_effect = Exception("LLM error")
 
-        email = {
-            "id": "test_email_error",
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
-        }
+        email = sample_email
 
         result = agent.process_email(email)
 
         assert result is False
         # Should NOT be marked as processed due to error
-        assert "test_email_error" not in agent.processed_emails
+        assert email["id"] not in agent.processed_emails
+
+    def test_truncated_reply_leaves_email_unprocessed(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
+    ):
+        """A reply cut off by max_tokens is retried on the next poll."""
+        agent = EmailClassifierAgent()
+        mock_llm_provider.classify_email.side_effect = TruncatedResponseError(
+            "truncated"
+        )
+
+        email = sample_email
+
+        assert agent.process_email(email) is False
+        assert email["id"] not in agent.processed_emails
 
     def test_multiple_emails_state_tracking(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self,
+        mock_config_with_state,
+        mock_gmail_client,
+        mock_llm_provider,
+        sample_emails_batch,
     ):
         """Test state tracking with multiple emails."""
         agent = EmailClassifierAgent()
 
-        emails = [
-            {
-                "id": f"email_{i}",
-                "subject": f"Email {i}",
-                "from": "test@example.com",
-                "body": "Test",
-            }
-            for i in range(5)
-        ]
-
         # Process all emails
-        for email in emails:
+        for email in sample_emails_batch:
             agent.process_email(email)
 
         # All should be in state
@@ -304,31 +438,28 @@ class TestEmailClassifierAgentStateTracking:
         for i in range(5):
             assert f"email_{i}" in agent.processed_emails
 
-        # Verify state file
-        with open(mock_config_with_state.STATE_FILE, "r") as f:
-            state_data = json.load(f)
-        assert len(state_data["processed_emails"]) == 5
+        # Verify state on disk
+        saved = state_store.load_state(mock_config_with_state.STATE_FILE, 30)
+        assert len(saved) == 5
 
         # Process same emails again
-        for email in emails:
+        for email in sample_emails_batch:
             agent.process_email(email)
 
         # LLM should only be called 5 times (once per unique email)
         assert mock_llm_provider.classify_email.call_count == 5
 
     def test_state_retention_removes_old_entries(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, now_utc
     ):
         """Test that old entries are removed based on retention period."""
-        from datetime import datetime, timedelta
-
         # Set retention to 7 days
         mock_config_with_state.STATE_RETENTION_DAYS = 7
 
         # Create state with old and new emails
-        old_timestamp = (datetime.now(timezone.utc) - timedelta(days=10)).isoformat()
-        recent_timestamp = (datetime.now(timezone.utc) - timedelta(days=3)).isoformat()
-        current_timestamp = datetime.now(timezone.utc).isoformat()
+        old_timestamp = (now_utc - timedelta(days=10)).isoformat()
+        recent_timestamp = (now_utc - timedelta(days=3)).isoformat()
+        current_timestamp = now_utc.isoformat()
 
         state_data = {
             "processed_emails": {
@@ -338,8 +469,7 @@ class TestEmailClassifierAgentStateTracking:
                 "current_email": current_timestamp,
             }
         }
-        with open(mock_config_with_state.STATE_FILE, "w") as f:
-            json.dump(state_data, f)
+        Path(mock_config_with_state.STATE_FILE).write_text(json.dumps(state_data))
 
         agent = EmailClassifierAgent()
 
@@ -350,14 +480,28 @@ class TestEmailClassifierAgentStateTracking:
         assert "old_email_1" not in agent.processed_emails
         assert "old_email_2" not in agent.processed_emails
 
+    def test_state_retention_cutoff_is_inclusive(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, now_utc
+    ):
+        """Test that an entry exactly at the retention cutoff is kept."""
+        mock_config_with_state.STATE_RETENTION_DAYS = 7
+        cutoff = int((now_utc - timedelta(days=7)).timestamp())
+        state_data = {
+            "processed_emails": {"at_cutoff": cutoff, "past_cutoff": cutoff - 1}
+        }
+        Path(mock_config_with_state.STATE_FILE).write_text(json.dumps(state_data))
+
+        agent = EmailClassifierAgent()
+
+        assert agent.processed_emails == {"at_cutoff": cutoff}
+
     def test_state_retention_migration_from_list(
         self, mock_config_with_state, mock_gmail_client, mock_llm_provider
     ):
         """Test migration from old list format to new dict format."""
         # Create state file with old list format
         state_data = {"processed_emails": ["email1", "email2", "email3"]}
-        with open(mock_config_with_state.STATE_FILE, "w") as f:
-            json.dump(state_data, f)
+        Path(mock_config_with_state.STATE_FILE).write_text(json.dumps(state_data))
 
         agent = EmailClassifierAgent()
 
@@ -367,27 +511,19 @@ class TestEmailClassifierAgentStateTracking:
         assert "email2" in agent.processed_emails
         assert "email3" in agent.processed_emails
 
-        # All should have timestamps
+        # All should have epoch-second timestamps
         for email_id in ["email1", "email2", "email3"]:
-            assert isinstance(agent.processed_emails[email_id], str)
-            # Verify it's a valid ISO format timestamp
-            from datetime import datetime
-
-            datetime.fromisoformat(agent.processed_emails[email_id])
+            assert isinstance(agent.processed_emails[email_id], int)
 
     def test_state_retention_disabled(
-        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, now_utc
     ):
         """Test that retention can be disabled (retention_days <= 0)."""
-        from datetime import datetime, timedelta
-
         # Disable retention
         mock_config_with_state.STATE_RETENTION_DAYS = 0
 
         # Create state with very old emails
-        very_old_timestamp = (
-            datetime.now(timezone.utc) - timedelta(days=365)
-        ).isoformat()
+        very_old_timestamp = (now_utc - timedelta(days=365)).isoformat()
 
         state_data = {
             "processed_emails": {
@@ -395,8 +531,7 @@ class TestEmailClassifierAgentStateTracking:
                 "old_email_2": very_old_timestamp,
             }
         }
-        with open(mock_config_with_state.STATE_FILE, "w") as f:
-            json.dump(state_data, f)
+        Path(mock_config_with_state.STATE_FILE).write_text(json.dumps(state_data))
 
         agent = EmailClassifierAgent()
 
@@ -405,19 +540,38 @@ class TestEmailClassifierAgentStateTracking:
         assert "old_email_1" in agent.processed_emails
         assert "old_email_2" in agent.processed_emails
 
+    def test_state_migration_from_iso_timestamps(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        """Test that ISO-8601 timestamps are migrated to epoch seconds."""
+        state_data = {
+            "processed_emails": {
+                "iso_email": "2026-01-01T00:00:00+00:00",
+                "epoch_email": 1767225600,
+                "bad_email": "not a timestamp",
+            }
+        }
+        Path(mock_config_with_state.STATE_FILE).write_text(json.dumps(state_data))
+        mock_config_with_state.STATE_RETENTION_DAYS = 0
+
+        agent = EmailClassifierAgent()
+
+        assert agent.processed_emails == {
+            "iso_email": 1767225600,
+            "epoch_email": 1767225600,
+        }
+
     def test_cleanup_old_state_periodic(
         self, mock_config_with_state, mock_gmail_client, mock_llm_provider
     ):
         """Test that periodic cleanup in run_continuous works."""
-        from datetime import datetime, timedelta
-
         mock_config_with_state.STATE_RETENTION_DAYS = 5
 
         agent = EmailClassifierAgent()
 
         # Add old and new emails
-        old_timestamp = (datetime.now(timezone.utc) - timedelta(days=10)).isoformat()
-        new_timestamp = datetime.now(timezone.utc).isoformat()
+        old_timestamp = int(time.time()) - 10 * 86400
+        new_timestamp = int(time.time())
 
         agent.processed_emails["old_email"] = old_timestamp
         agent.processed_emails["new_email"] = new_timestamp
@@ -432,33 +586,427 @@ class TestEmailClassifierAgentStateTracking:
         assert "new_email" in agent.processed_emails
         assert "old_email" not in agent.processed_emails
 
-    def test_process_email_stores_timestamp(
+    def test_cleanup_runs_at_most_once_per_interval(
         self, mock_config_with_state, mock_gmail_client, mock_llm_provider
     ):
-        """Test that processing an email stores a valid timestamp."""
-        from datetime import datetime
+        """Test that retention cleanup is skipped until the interval passes."""
+        mock_config_with_state.STATE_RETENTION_DAYS = 5
+        agent = EmailClassifierAgent()
+        agent.processed_emails["old_email"] = int(time.time()) - 10 * 86400
+
+        agent._maybe_cleanup_state()
+        assert "old_email" in agent.processed_emails
 
+        agent._next_cleanup = time.time() - 1
+        agent._maybe_cleanup_state()
+        assert "old_email" not in agent.processed_emails
+        assert agent._next_cleanup > time.time()
+
+    def test_process_email_stores_timestamp(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider, sample_email
+    ):
+        """Test that processing an email stores a valid timestamp."""
         agent = EmailClassifierAgent()
 
-        email = {
-            "id": "test_timestamp_email",
-            "subject": "Test Email",
-            "from": "test@example.com",
-            "body": "Test body",
-        }
+        email = sample_email
 
         agent.process_email(email)
 
         # Email should be in state
-        assert "test_timestamp_email" in agent.processed_emails
+        assert email["id"] in agent.processed_emails
 
-        # Should have a valid ISO format timestamp
-        timestamp_str = agent.processed_emails["test_timestamp_email"]
-        timestamp = datetime.fromisoformat(timestamp_str)
+        # Should have an epoch-second timestamp
+        timestamp = agent.processed_emails[email["id"]]
+        assert isinstance(timestamp, int)
 
         # Timestamp should be recent (within last minute)
-        time_diff = datetime.now(timezone.utc) - timestamp
-        assert time_diff.total_seconds() < 60
+        assert time.time() - timestamp < 60
+
+
+@pytest.mark.unit
+class TestConcurrentProcessing:
+    """Tests for batch processing with concurrent classification."""
+
+    @staticmethod
+    def _emails(count):
+        return [
+            {
+                "id": f"email_{i}",
+                "subject": f"Email {i}",
+                "from": "test@example.com",
+                "body": "Test",
+            }
+            for i in range(count)
+        ]
+
+    def test_process_emails_classifies_all(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(5)) == 5
+        assert mock_llm_provider.classify_email.call_count == 5
+        # All five share a label set, so they are labeled in one call
+        mock_gmail_client.batch_apply_labels.assert_called_once()
+        groups = mock_gmail_client.batch_apply_labels.call_args.args[0]
+        assert sorted(sum(groups.values(), [])) == [f"email_{i}" for i in range(5)]
+        assert len(agent.processed_emails) == 5
+
+    def test_duplicate_emails_classified_once(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        emails = self._emails(3)
+        for email in emails:
+            email["subject"] = "Weekly digest"
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(emails) == 3
+        assert mock_llm_provider.classify_email.call_count == 1
+        groups = mock_gmail_client.batch_apply_labels.call_args.args[0]
+        assert sorted(sum(groups.values(), [])) == ["email_0", "email_1", "email_2"]
+
+    def test_duplicates_share_failed_classification(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        emails = self._emails(2)
+        emails[1]["subject"] = emails[0]["subject"]
+        mock_llm_provider.classify_email.side_effect = RuntimeError("boom")
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(emails) == 0
+        assert mock_llm_provider.classify_email.call_count == 1
+        assert agent.processed_emails == {}
+
+    def test_labels_grouped_by_label_set(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_llm_provider.classify_email.side_effect = lambda email, **kwargs: (
+            ["Github", "AWS"] if email["id"] == "email_1" else ["AWS"]
+        )
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(3)) == 3
+        groups = mock_gmail_client.batch_apply_labels.call_args.args[0]
+        assert groups == {
+            ("label_id_AWS",): ["email_0", "email_2"],
+            ("label_id_AWS", "label_id_Github"): ["email_1"],
+        }
+        mock_gmail_client.add_labels_to_message.assert_not_called()
+
+    def test_unlabeled_emails_not_marked_processed(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_llm_provider.classify_email.side_effect = lambda email, **kwargs: (
+            ["Github"] if email["id"] == "email_1" else ["AWS"]
+        )
+        # The batchModify for the Github set fails
+        mock_gmail_client.batch_apply_labels.side_effect = lambda groups, **kwargs: (
+            groups[("label_id_AWS",)]
+        )
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(2)) == 1
+        assert "email_0" in agent.processed_emails
+        assert "email_1" not in agent.processed_emails
+
+    def test_labeling_error_still_flushes_state(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_gmail_client.batch_apply_labels.side_effect = RuntimeError("boom")
+        agent = EmailClassifierAgent()
+        agent._maybe_flush = Mock()
+
+        with pytest.raises(RuntimeError):
+            agent.process_emails(self._emails(1))
+
+        assert "email_0" not in agent.processed_emails
+        agent._maybe_flush.assert_called_once_with(force=True)
+
+    def test_classifications_run_concurrently(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        """All calls must be in flight together when within the limit."""
+        import threading
+
+        barrier = threading.Barrier(3, timeout=5)
+
+        def classify(**kwargs):
+            barrier.wait()  # Only released once 3 calls overlap
+            return ["AWS"]
+
+        mock_llm_provider.classify_email.side_effect = classify
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(3)) == 3
+
+    def test_concurrency_is_bounded(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        import threading
+        import time
+
+        mock_config_with_state.LLM_CONCURRENCY = 2
+        lock = threading.Lock()
+        in_flight = 0
+        peak = 0
+
+        def classify(**kwargs):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+            return ["AWS"]
+
+        mock_llm_provider.classify_email.side_effect = classify
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(6)) == 6
+        assert peak <= 2
+
+    def test_classification_overlaps_preparing_later_emails(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        """The first email is classified while the second is still prepared."""
+        import threading
+
+        started = threading.Event()
+
+        def classify(**kwargs):
+            started.set()
+            return ["AWS"]
+
+        mock_llm_provider.classify_email.side_effect = classify
+        agent = EmailClassifierAgent()
+        prepare = agent._prepare_email
+        overlapped = []
+
+        def slow_prepare(email):
+            if email["id"] == "email_1":
+                overlapped.append(started.wait(timeout=5))
+            return prepare(email)
+
+        agent._prepare_email = slow_prepare
+
+        assert agent.process_emails(self._emails(2)) == 2
+        assert overlapped == [True]
+
+    def test_worker_threads_reused_across_polls(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        import threading
+
+        mock_config_with_state.LLM_CONCURRENCY = 1
+        threads = set()
+
+        def classify(**kwargs):
+            threads.add(threading.current_thread().ident)
+            return ["AWS"]
+
+        mock_llm_provider.classify_email.side_effect = classify
+        agent = EmailClassifierAgent()
+
+        emails = self._emails(4)
+        agent.process_emails(emails[:2])
+        agent.process_emails(emails[2:])
+
+        assert len(threads) == 1
+
+    def test_failure_does_not_affect_other_emails(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        def classify(email, **kwargs):
+            if email["id"] == "email_1":
+                raise RuntimeError("LLM error")
+            return ["AWS"]
+
+        mock_llm_provider.classify_email.side_effect = classify
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(3)) == 2
+        assert "email_1" not in agent.processed_emails
+        assert "email_0" in agent.processed_emails
+        assert "email_2" in agent.processed_emails
+
+    def test_skipped_emails_not_classified(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        agent = EmailClassifierAgent()
+        agent.processed_emails["email_0"] = 1767225600
+
+        assert agent.process_emails(self._emails(2)) == 2
+        assert mock_llm_provider.classify_email.call_count == 1
+
+    def test_sender_rules_skip_llm(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.RULES = {"Github": {"from": ["@github.com"]}}
+        agent = EmailClassifierAgent()
+        emails = self._emails(2)
+        emails[0]["from"] = "noreply@github.com"
+
+        assert agent.process_emails(emails) == 2
+        assert mock_llm_provider.classify_email.call_count == 1
+        groups = mock_gmail_client.batch_apply_labels.call_args.args[0]
+        assert groups[("label_id_Github",)] == ["email_0"]
+        assert mock_gmail_client.batch_apply_labels.call_args.kwargs == {
+            "remove_from_inbox": True
+        }
+
+    def test_batched_classification(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.CLASSIFY_BATCH_SIZE = 2
+        mock_llm_provider.classify_emails_batch.side_effect = lambda emails, **kwargs: [
+            ["AWS"] for _ in emails
+        ]
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(5)) == 5
+        # Two full batches, and the single leftover email classified alone
+        assert mock_llm_provider.classify_emails_batch.call_count == 2
+        assert mock_llm_provider.classify_email.call_count == 1
+        assert len(agent.processed_emails) == 5
+
+    def test_failed_batch_fails_its_emails(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.CLASSIFY_BATCH_SIZE = 2
+
+        def classify_batch(emails, **kwargs):
+            if emails[0]["id"] == "email_0":
+                raise RuntimeError("LLM error")
+            return [["AWS"] for _ in emails]
+
+        mock_llm_provider.classify_emails_batch.side_effect = classify_batch
+        agent = EmailClassifierAgent()
+
+        assert agent.process_emails(self._emails(4)) == 2
+        assert "email_0" not in agent.processed_emails
+        assert "email_1" not in agent.processed_emails
+        assert "email_2" in agent.processed_emails
+
+    def test_structured_output_setting_passed_to_classifier(
+        self, mock_config_with_state, mock_gmail_client
+    ):
+        mock_config_with_state.OPENROUTER_STRUCTURED_OUTPUT = True
+        with patch("email_classifier_agent.OpenRouterClassifier") as classifier_cls:
+            EmailClassifierAgent()
+
+        assert classifier_cls.call_args.kwargs["structured_output"] is True
+
+
+@pytest.mark.unit
+class TestFetchNewEmails:
+    """Tests for skipping the unread list while the inbox is unchanged."""
+
+    def test_lists_unprocessed_unread_emails(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.MAX_EMAILS_PER_POLL = 10
+        mock_gmail_client.get_unread_messages.return_value = [{"id": "e1"}]
+        agent = EmailClassifierAgent()
+
+        assert agent._fetch_new_emails() == [{"id": "e1"}]
+        mock_gmail_client.get_unread_messages.assert_called_once_with(
+            max_results=10, skip_ids=agent.processed_emails
+        )
+        # Backlog may remain, so the next poll lists again
+        assert agent._history_id is None
+
+    def test_idle_inbox_only_checks_history(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_gmail_client.get_history_id.return_value = "100"
+        mock_gmail_client.get_unread_messages.return_value = []
+        mock_gmail_client.get_inbox_changes.return_value = (False, "105")
+        agent = EmailClassifierAgent()
+
+        assert agent._fetch_new_emails() == []
+        assert agent._fetch_new_emails() == []
+        assert agent._fetch_new_emails() == []
+
+        assert mock_gmail_client.get_unread_messages.call_count == 1
+        assert mock_gmail_client.get_inbox_changes.call_args_list[0].args == ("100",)
+        assert mock_gmail_client.get_inbox_changes.call_args_list[1].args == ("105",)
+
+    def test_failed_list_is_retried_next_poll(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_gmail_client.get_history_id.return_value = "100"
+        mock_gmail_client.get_unread_messages.side_effect = [None, [{"id": "e1"}]]
+        agent = EmailClassifierAgent()
+
+        assert agent._fetch_new_emails() == []
+        assert agent._history_id is None
+        assert agent._fetch_new_emails() == [{"id": "e1"}]
+        mock_gmail_client.get_inbox_changes.assert_not_called()
+
+    def test_inbox_change_triggers_list(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_gmail_client.get_history_id.return_value = "100"
+        mock_gmail_client.get_unread_messages.side_effect = [[], [{"id": "e1"}]]
+        mock_gmail_client.get_inbox_changes.return_value = (True, "110")
+        agent = EmailClassifierAgent()
+
+        assert agent._fetch_new_emails() == []
+        assert agent._fetch_new_emails() == [{"id": "e1"}]
+        assert mock_gmail_client.get_unread_messages.call_count == 2
+
+
+@pytest.mark.unit
+class TestAdaptivePollInterval:
+    """Tests for backing off the poll interval while the inbox is idle."""
+
+    def test_empty_polls_back_off_to_max(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.POLL_INTERVAL_SECONDS = 60
+        agent = EmailClassifierAgent()
+
+        interval = 60
+        intervals = []
+        for _ in range(4):
+            interval = agent._next_poll_interval(interval, False, 120)
+            intervals.append(interval)
+
+        assert intervals == [90, 120, 120, 120]
+
+    def test_new_email_resets_interval(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.POLL_INTERVAL_SECONDS = 60
+        agent = EmailClassifierAgent()
+
+        assert agent._next_poll_interval(120, True, 120) == 60
+
+    def test_max_at_base_keeps_fixed_interval(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.POLL_INTERVAL_SECONDS = 60
+        agent = EmailClassifierAgent()
+
+        assert agent._next_poll_interval(60, False, 60) == 60
+        assert agent._next_poll_interval(60, False, 30) == 60
+
+    def test_run_continuous_sleeps_longer_when_idle(
+        self, mock_config_with_state, mock_gmail_client, mock_llm_provider
+    ):
+        mock_config_with_state.POLL_INTERVAL_SECONDS = 60
+        mock_gmail_client.get_unread_messages.return_value = []
+        mock_gmail_client.get_inbox_changes.return_value = (False, "1")
+        agent = EmailClassifierAgent()
+
+        with patch(
+            "email_classifier_agent.time.sleep",
+            side_effect=[None, None, KeyboardInterrupt],
+        ) as mock_sleep:
+            agent.run_continuous(max_poll_interval=600)
+
+        assert [c.args[0] for c in mock_sleep.call_args_list] == [90, 135, 202.5]
 
 
 @pytest.mark.unit
@@ -23,6 +23,48 @@ def _b64(text: str) -> str:
     return base64.urlsafe_b64encode(text.encode("utf-8")).decode("utf-8")
 
 
+class _FakeBatch:
+    """Stand-in for BatchHttpRequest that answers from a dict of responses."""
+
+    def __init__(self, callback, responses):
+        self.callback = callback
+        self.responses = responses
+        self.request_ids = []
+
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        for request_id in self.request_ids:
+            response = self.responses.get(request_id)
+            if isinstance(response, Exception):
+                self.callback(request_id, None, response)
+            else:
+                self.callback(request_id, response, None)
+
+
+def _install_batches(client, responses):
+    """Route new_batch_http_request to fake batches; return the batches made."""
+    batches = []
+
+    def new_batch(callback):
+        batches.append(_FakeBatch(callback, responses))
+        return batches[-1]
+
+    client.service.new_batch_http_request.side_effect = new_batch
+    return batches
+
+
+def _message(subject):
+    return {
+        "payload": {
+            "headers": [{"name": "Subject", "value": subject}],
+            "body": {"data": _b64("hello")},
+        },
+        "snippet": "",
+    }
+
+
 @pytest.fixture
 def client():
     """A GmailClient with _authenticate bypassed and a mocked service attached."""
@@ -43,15 +85,21 @@ class TestAuthenticate:
 
         with (
             patch("gmail_client.os.path.exists", return_value=True),
-            patch("gmail_client.open", mock_open(read_data=b"irrelevant")),
-            patch("gmail_client.pickle.load", return_value=creds),
+            patch("gmail_client.open", mock_open(read_data=b"{}")),
+            patch(
+                "gmail_client.Credentials.from_authorized_user_info",
+                return_value=creds,
+            ),
             patch("gmail_client.build") as mock_build,
         ):
             mock_build.return_value = "gmail-service"
             c = GmailClient("creds.json", "token.json", ["scope"])
 
         assert c.service == "gmail-service"
-        mock_build.assert_called_once_with("gmail", "v1", credentials=creds)
+        mock_build.assert_called_once()
+        http = mock_build.call_args.kwargs["http"]
+        assert http.credentials is creds
+        assert http.http.timeout == GmailClient.HTTP_TIMEOUT_SECONDS
 
     def test_refreshes_expired_token(self):
         creds = MagicMock()
@@ -61,14 +109,60 @@ class TestAuthenticate:
 
         with (
             patch("gmail_client.os.path.exists", return_value=True),
-            patch("gmail_client.open", mock_open(read_data=b"irrelevant")),
-            patch("gmail_client.pickle.load", return_value=creds),
-            patch("gmail_client.pickle.dump"),
+            patch("gmail_client.open", mock_open(read_data=b"{}")) as mock_file,
+            patch(
+                "gmail_client.Credentials.from_authorized_user_info",
+                return_value=creds,
+            ),
             patch("gmail_client.build"),
         ):
             GmailClient("creds.json", "token.json", ["scope"])
 
         creds.refresh.assert_called_once()
+        mock_file().write.assert_called_once_with(creds.to_json())
+
+    def test_migrates_pickled_token_to_json(self):
+        creds = MagicMock()
+        creds.valid = True
+
+        with (
+            patch("gmail_client.os.path.exists", return_value=True),
+            patch(
+                "gmail_client.open", mock_open(read_data=pickle.dumps("legacy"))
+            ) as mock_file,
+            patch("gmail_client.pickle.loads", return_value=creds) as mock_loads,
+            patch("gmail_client.build"),
+        ):
+            GmailClient("creds.json", "token.json", ["scope"])
+
+        mock_loads.assert_called_once()
+        mock_file.assert_called_with("token.json", "w")
+        mock_file().write.assert_called_once_with(creds.to_json())
+
+    def test_read_only_token_file_is_not_fatal(self):
+        creds = MagicMock()
+        creds.valid = False
+        creds.expired = True
+        creds.refresh_token = "refresh"
+
+        def fake_open(path, mode="r"):
+            if "w" in mode:
+                raise PermissionError("read-only file system")
+            return mock_open(read_data=b"{}")()
+
+        with (
+            patch("gmail_client.os.path.exists", return_value=True),
+            patch("gmail_client.open", side_effect=fake_open),
+            patch(
+                "gmail_client.Credentials.from_authorized_user_info",
+                return_value=creds,
+            ),
+            patch("gmail_client.build") as mock_build,
+        ):
+            GmailClient("creds.json", "token.json", ["scope"])
+
+        # Refreshed credentials are still used for this run
+        assert mock_build.call_args.kwargs["http"].credentials is creds
 
     def test_runs_oauth_flow_when_no_token(self):
         new_creds = MagicMock()
@@ -76,8 +170,7 @@ class TestAuthenticate:
         with (
             patch("gmail_client.os.path.exists", return_value=False),
             patch("gmail_client.InstalledAppFlow") as mock_flow_cls,
-            patch("gmail_client.open", mock_open()),
-            patch("gmail_client.pickle.dump") as mock_dump,
+            patch("gmail_client.open", mock_open()) as mock_file,
             patch("gmail_client.build"),
         ):
             mock_flow = MagicMock()
@@ -87,8 +180,8 @@ class TestAuthenticate:
             GmailClient("creds.json", "token.json", ["scope"], headless=False)
 
         mock_flow.run_local_server.assert_called_once_with(port=8080)
-        # Credentials get persisted
-        assert mock_dump.called
+        # Credentials get persisted as JSON
+        mock_file().write.assert_called_once_with(new_creds.to_json())
 
     def test_headless_mode_uses_console_flow(self):
         new_creds = MagicMock()
@@ -97,7 +190,6 @@ class TestAuthenticate:
             patch("gmail_client.os.path.exists", return_value=False),
             patch("gmail_client.InstalledAppFlow") as mock_flow_cls,
             patch("gmail_client.open", mock_open()),
-            patch("gmail_client.pickle.dump"),
             patch("gmail_client.build"),
             patch.object(
                 GmailClient, "_run_console_flow", return_value=new_creds
@@ -115,14 +207,24 @@ class TestGetUnreadMessages:
         client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
             "messages": [{"id": "m1"}, {"id": "m2"}]
         }
-        with patch.object(
-            GmailClient,
-            "_get_message_details",
-            side_effect=[{"id": "m1"}, {"id": "m2"}],
-        ):
-            result = client.get_unread_messages(max_results=5)
+        batches = _install_batches(
+            client, {"m1": _message("First"), "m2": _message("Second")}
+        )
+
+        result = client.get_unread_messages(max_results=5)
 
         assert [m["id"] for m in result] == ["m1", "m2"]
+        assert [m["subject"] for m in result] == ["First", "Second"]
+        # Both fetches share one batch HTTP request
+        assert len(batches) == 1
+        list_kwargs = (
+            client.service.users.return_value.messages.return_value.list.call_args.kwargs
+        )
+        assert list_kwargs["fields"] == "messages/id"
+        get_kwargs = (
+            client.service.users.return_value.messages.return_value.get.call_args.kwargs
+        )
+        assert get_kwargs["fields"] == GmailClient.MESSAGE_FIELDS
 
     def test_returns_empty_list_when_no_messages(self, client):
         client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = (
@@ -134,22 +236,98 @@ class TestGetUnreadMessages:
         client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
             "messages": [{"id": "m1"}, {"id": "m2"}]
         }
-        with patch.object(
-            GmailClient, "_get_message_details", side_effect=[{"id": "m1"}, None]
-        ):
-            result = client.get_unread_messages()
+        _install_batches(client, {"m1": _message("First"), "m2": _make_http_error()})
+
+        result = client.get_unread_messages()
 
         assert [m["id"] for m in result] == ["m1"]
 
-    def test_http_error_returns_empty_list(self, client):
+    def test_fetches_are_chunked_into_batches(self, client):
+        ids = [f"m{i}" for i in range(GmailClient.BATCH_SIZE + 1)]
+        client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
+            "messages": [{"id": msg_id} for msg_id in ids]
+        }
+        batches = _install_batches(client, {msg_id: _message(msg_id) for msg_id in ids})
+
+        result = client.get_unread_messages(max_results=len(ids))
+
+        assert [m["id"] for m in result] == ids
+        assert [len(b.request_ids) for b in batches] == [GmailClient.BATCH_SIZE, 1]
+
+    def test_http_error_returns_none(self, client):
+        """A failed list is reported, not mistaken for an empty inbox."""
         client.service.users.return_value.messages.return_value.list.return_value.execute.side_effect = (
             _make_http_error()
         )
-        assert client.get_unread_messages() == []
+        assert client.get_unread_messages() is None
+
+    def test_all_detail_fetches_failing_returns_none(self, client):
+        client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
+            "messages": [{"id": "m1"}]
+        }
+        _install_batches(client, {"m1": _make_http_error()})
+
+        assert client.get_unread_messages() is None
+
+    def test_skipped_ids_not_fetched(self, client):
+        client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
+            "messages": [{"id": "m1"}, {"id": "m2"}]
+        }
+        batches = _install_batches(client, {"m2": _message("Second")})
+
+        result = client.get_unread_messages(skip_ids={"m1": 1767225600})
+
+        assert [m["id"] for m in result] == ["m2"]
+        assert batches[0].request_ids == ["m2"]
+
+    def test_all_skipped_fetches_nothing(self, client):
+        client.service.users.return_value.messages.return_value.list.return_value.execute.return_value = {
+            "messages": [{"id": "m1"}]
+        }
+        batches = _install_batches(client, {})
+
+        assert client.get_unread_messages(skip_ids={"m1"}) == []
+        assert batches == []
 
 
 @pytest.mark.unit
-class TestGetMessageDetails:
+class TestMailboxHistory:
+    def test_get_history_id(self, client):
+        client.service.users.return_value.getProfile.return_value.execute.return_value = {
+            "historyId": "500"
+        }
+        assert client.get_history_id() == "500"
+
+    def test_get_history_id_http_error(self, client):
+        client.service.users.return_value.getProfile.return_value.execute.side_effect = (
+            _make_http_error()
+        )
+        assert client.get_history_id() is None
+
+    def test_no_inbox_changes(self, client):
+        history = client.service.users.return_value.history.return_value
+        history.list.return_value.execute.return_value = {"historyId": "510"}
+
+        assert client.get_inbox_changes("500") == (False, "510")
+        assert history.list.call_args.kwargs["startHistoryId"] == "500"
+        assert history.list.call_args.kwargs["labelId"] == "INBOX"
+
+    def test_inbox_changed(self, client):
+        client.service.users.return_value.history.return_value.list.return_value.execute.return_value = {
+            "history": [{"id": "505"}],
+            "historyId": "510",
+        }
+        assert client.get_inbox_changes("500") == (True, "510")
+
+    def test_expired_history_id_counts_as_changed(self, client):
+        client.service.users.return_value.history.return_value.list.return_value.execute.side_effect = _make_http_error(
+            404
+        )
+        assert client.get_inbox_changes("1") == (True, None)
+
+
+@pytest.mark.unit
+class TestParseMessage:
     def _payload_with_headers(self, headers, body_text="hello"):
         return {
             "payload": {
@@ -167,11 +345,7 @@ class TestGetMessageDetails:
                 {"name": "Date", "value": "2026-04-24"},
             ]
         )
-        client.service.users.return_value.messages.return_value.get.return_value.execute.return_value = (
-            message
-        )
-
-        result = client._get_message_details("m1")
+        result = client._parse_message("m1", message)
 
         assert result["id"] == "m1"
         assert result["subject"] == "Hi"
@@ -181,34 +355,23 @@ class TestGetMessageDetails:
         assert result["snippet"] == "snip"
 
     def test_fills_defaults_when_headers_missing(self, client):
-        client.service.users.return_value.messages.return_value.get.return_value.execute.return_value = self._payload_with_headers(
-            []
-        )
-        result = client._get_message_details("m1")
+        result = client._parse_message("m1", self._payload_with_headers([]))
 
         assert result["subject"] == "No Subject"
         assert result["from"] == "Unknown"
         assert result["date"] == "Unknown"
 
     def test_header_matching_is_case_insensitive(self, client):
-        client.service.users.return_value.messages.return_value.get.return_value.execute.return_value = self._payload_with_headers(
-            [{"name": "subject", "value": "Lower"}]
-        )
-        assert client._get_message_details("m1")["subject"] == "Lower"
+        message = self._payload_with_headers([{"name": "subject", "value": "Lower"}])
+        assert client._parse_message("m1", message)["subject"] == "Lower"
 
     def test_body_truncated_to_5000_chars(self, client):
         long_text = "x" * 6000
-        client.service.users.return_value.messages.return_value.get.return_value.execute.return_value = {
+        message = {
             "payload": {"headers": [], "body": {"data": _b64(long_text)}},
             "snippet": "",
         }
-        assert len(client._get_message_details("m1")["body"]) == 5000
-
-    def test_http_error_returns_none(self, client):
-        client.service.users.return_value.messages.return_value.get.return_value.execute.side_effect = (
-            _make_http_error()
-        )
-        assert client._get_message_details("m1") is None
+        assert len(client._parse_message("m1", message)["body"]) == 5000
 
 
 @pytest.mark.unit
@@ -222,6 +385,23 @@ class TestGetMessageBody:
         }
         assert client._get_message_body(payload) == "plain-body"
 
+    def test_html_part_not_decoded_when_plain_exists(self, client):
+        payload = {
+            "parts": [
+                {"mimeType": "text/html", "body": {"data": "not base64!"}},
+                {"mimeType": "text/plain", "body": {"data": _b64("plain-body")}},
+            ]
+        }
+        with patch("gmail_client.html_to_text") as html_to_text:
+            assert client._get_message_body(payload) == "plain-body"
+        html_to_text.assert_not_called()
+
+    def test_long_plain_body_decoded_only_to_limit(self, client):
+        client.MAX_BODY_CHARS = 10
+        payload = {"mimeType": "text/plain", "body": {"data": _b64("é" * 100)}}
+
+        assert client._get_message_body(payload) == "é" * 10
+
     def test_falls_back_to_text_html_when_no_plain(self, client):
         payload = {
             "parts": [
@@ -292,6 +472,21 @@ class TestCreateLabelIfNotExists:
         )
         assert client.create_label_if_not_exists("Anything") is None
 
+    def test_label_list_fetched_once(self, client):
+        labels = client.service.users.return_value.labels.return_value
+        labels.list.return_value.execute.return_value = {
+            "labels": [{"id": "L1", "name": "Billing"}]
+        }
+        labels.create.return_value.execute.return_value = {"id": "L2", "name": "New"}
+
+        assert client.create_label_if_not_exists("Billing") == "L1"
+        assert client.create_label_if_not_exists("New") == "L2"
+        assert client.create_label_if_not_exists("New") == "L2"
+
+        assert labels.list.call_count == 1
+        assert labels.create.call_count == 1
+        assert client.list_labels() == {"Billing": "L1", "New": "L2"}
+
 
 @pytest.mark.unit
 class TestAddLabelsToMessage:
@@ -321,6 +516,57 @@ class TestAddLabelsToMessage:
         client.add_labels_to_message("m1", ["L1"])
 
 
+@pytest.mark.unit
+class TestBatchApplyLabels:
+    def test_one_call_per_label_set(self, client):
+        groups = {("L1",): ["m1", "m2"], ("L1", "L2"): ["m3"]}
+
+        assert client.batch_apply_labels(groups, remove_from_inbox=True) == [
+            "m1",
+            "m2",
+            "m3",
+        ]
+
+        calls = (
+            client.service.users.return_value.messages.return_value.batchModify.call_args_list
+        )
+        assert [c.kwargs["body"] for c in calls] == [
+            {"ids": ["m1", "m2"], "addLabelIds": ["L1"], "removeLabelIds": ["INBOX"]},
+            {"ids": ["m3"], "addLabelIds": ["L1", "L2"], "removeLabelIds": ["INBOX"]},
+        ]
+
+    def test_large_groups_chunked(self, client):
+        client.BATCH_MODIFY_SIZE = 2
+
+        assert client.batch_apply_labels({("L1",): ["m1", "m2", "m3"]}) == [
+            "m1",
+            "m2",
+            "m3",
+        ]
+
+        calls = (
+            client.service.users.return_value.messages.return_value.batchModify.call_args_list
+        )
+        assert [c.kwargs["body"]["ids"] for c in calls] == [["m1", "m2"], ["m3"]]
+        assert "removeLabelIds" not in calls[0].kwargs["body"]
+
+    def test_http_error_skips_failed_chunk(self, client):
+        client.service.users.return_value.messages.return_value.batchModify.return_value.execute.side_effect = [
+            _make_http_error(),
+            None,
+        ]
+
+        groups = {("L1",): ["m1"], ("L2",): ["m2", "m3"]}
+        assert client.batch_apply_labels(groups) == ["m2", "m3"]
+
+    def test_socket_timeout_skips_failed_chunk(self, client):
+        client.service.users.return_value.messages.return_value.batchModify.return_value.execute.side_effect = TimeoutError(
+            "timed out"
+        )
+
+        assert client.batch_apply_labels({("L1",): ["m1"]}) == []
+
+
 @pytest.mark.unit
 class TestMarkAsRead:
     def test_removes_unread_label(self, client):
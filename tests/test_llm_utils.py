@@ -9,11 +9,16 @@ Tests cover:
 - Case-insensitive matching
 """
 
+import logging
+
 import pytest
 from llm_utils import (
     construct_email_content,
     build_classification_messages,
+    build_batch_classification_messages,
+    labels_response_format,
     parse_labels_from_response,
+    parse_batch_labels_from_response,
     log_classification_result,
 )
 
@@ -156,192 +161,237 @@ class TestBuildClassificationMessages:
         for label in available_labels:
             assert label in messages[0]["content"]
 
+    def test_system_prefix_stable_across_calls(self):
+        """Test that only the trailing marker sentence varies per request."""
+        first = build_classification_messages("Classify", ["Work"], "body one")
+        second = build_classification_messages("Classify", ["Work"], "body two")
 
-@pytest.mark.unit
-class TestParseLabelsParsing:
-    """Test JSON parsing edge cases."""
-
-    @pytest.fixture
-    def available_labels(self):
-        """Standard set of available labels for testing."""
-        return ["AWS", "Finance", "Work", "Personal"]
-
-    def test_plain_json_object(self, available_labels):
-        """Test parsing plain JSON object."""
-        response = '{"labels": ["AWS", "Finance"]}'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_json_in_markdown_code_block(self, available_labels):
-        """Test parsing JSON in markdown code block."""
-        response = """```json
-{"labels": ["AWS", "Finance"]}
-```"""
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_json_in_code_block_without_language(self, available_labels):
-        """Test parsing JSON in code block without language specifier."""
-        response = """```
-{"labels": ["AWS", "Finance"]}
-```"""
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_json_with_text_before(self, available_labels):
-        """Test parsing JSON with explanatory text before."""
-        response = 'Here are the labels: {"labels": ["AWS", "Finance"]}'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_json_with_text_after(self, available_labels):
-        """Test parsing JSON with text after."""
-        response = '{"labels": ["AWS", "Finance"]} These are the most relevant labels.'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_json_with_text_before_and_after(self, available_labels):
-        """Test parsing JSON with text on both sides."""
-        response = 'Based on analysis: {"labels": ["AWS", "Finance"]} Hope this helps!'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_json_array_format(self, available_labels):
-        """Test parsing JSON array directly."""
-        response = '["AWS", "Finance"]'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-
-    def test_invalid_json(self, available_labels):
-        """Test handling invalid JSON."""
-        response = '{"labels": ["AWS", "Finance"'  # Missing closing brackets
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == []
-
-    def test_json_with_wrong_structure(self, available_labels):
-        """Test handling JSON with wrong structure."""
-        response = '{"results": ["AWS", "Finance"]}'  # Wrong key
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == []
-
-    def test_json_with_non_string_labels(self, available_labels):
-        """Test handling non-string labels in array."""
-        response = '{"labels": ["AWS", 123, "Finance", null]}'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        # Should filter out non-string values
-        assert result == ["AWS", "Finance"]
-
-    def test_case_insensitive_matching(self, available_labels):
-        """Test case-insensitive label matching."""
-        response = '{"labels": ["aws", "FINANCE", "Work"]}'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        # Should match with proper casing
-        assert "AWS" in result
-        assert "Finance" in result
-        assert "Work" in result
-
-    def test_invalid_labels_filtered_out(self, available_labels):
-        """Test that invalid labels are filtered out."""
-        response = '{"labels": ["AWS", "InvalidLabel", "Finance"]}'
-
-        result = parse_labels_from_response(response, available_labels)
-
-        assert result == ["AWS", "Finance"]
-        assert "InvalidLabel" not in result
+        marker_start = first[0]["content"].index("The email markers")
+        assert first[0]["content"][:marker_start] == (
+            second[0]["content"][:marker_start]
+        )
+        assert "BEGIN_EMAIL_" not in first[0]["content"][:marker_start]
 
-    def test_empty_labels_array(self, available_labels):
-        """Test handling empty labels array."""
-        response = '{"labels": []}'
+    def test_cache_control_marks_static_prefix(self):
+        """Test that the cacheable prefix is a separate breakpointed block."""
+        messages = build_classification_messages(
+            "Classify emails.", ["Work"], "body", cache_control=True
+        )
 
-        result = parse_labels_from_response(response, available_labels)
+        prefix, markers = messages[0]["content"]
+        assert prefix["cache_control"] == {"type": "ephemeral"}
+        assert "Classify emails." in prefix["text"]
+        assert "BEGIN_EMAIL_" not in prefix["text"]
+        assert "cache_control" not in markers
+        assert "BEGIN_EMAIL_" in markers["text"]
 
-        assert result == []
 
-    def test_labels_field_not_a_list(self, available_labels):
-        """Test handling labels field that's not a list."""
-        response = '{"labels": "AWS"}'
+@pytest.mark.unit
+class TestBatchClassificationMessages:
+    """Test batched message construction and response parsing."""
 
-        result = parse_labels_from_response(response, available_labels)
+    def test_each_email_has_numbered_markers(self):
+        """Test that every email is delimited by its own indexed markers."""
+        messages = build_batch_classification_messages(
+            "Classify", ["Work"], ["body one", "body two"]
+        )
 
-        assert result == []
+        user = messages[1]["content"]
+        token = user.split("\n", 1)[0][len("BEGIN_EMAIL_") : -len("_1")]
+        assert f"BEGIN_EMAIL_{token}_1\nbody one\nEND_EMAIL_{token}_1" in user
+        assert f"BEGIN_EMAIL_{token}_2\nbody two\nEND_EMAIL_{token}_2" in user
+        assert "UNTRUSTED DATA" in messages[0]["content"]
+        assert '"classifications"' in messages[0]["content"]
+
+    def test_parse_batch_response(self):
+        """Test that results are mapped back by index and validated."""
+        response = (
+            '```json\n{"classifications": ['
+            '{"index": 2, "labels": ["work"]}, '
+            '{"index": 1, "labels": ["Personal", "Bogus"]}]}\n```'
+        )
 
-    def test_multiline_json_in_code_block(self, available_labels):
-        """Test parsing multiline JSON in code block."""
-        response = """```json
-{
-  "labels": [
-    "AWS",
-    "Finance"
-  ]
-}
-```"""
+        result = parse_batch_labels_from_response(response, ["Work", "Personal"], 2)
 
-        result = parse_labels_from_response(response, available_labels)
+        assert result == [["Personal"], ["Work"]]
 
-        assert result == ["AWS", "Finance"]
+    def test_parse_batch_response_missing_entries(self):
+        """Test that omitted or out-of-range indexes get no labels."""
+        response = (
+            'Sure: {"classifications": [{"index": 1, "labels": ["Work"]}, '
+            '{"index": 7, "labels": ["Work"]}]} done'
+        )
 
-    def test_nested_json_extraction(self, available_labels):
-        """Test extracting JSON from complex response."""
-        response = """The email discusses AWS billing and financial matters.
+        result = parse_batch_labels_from_response(response, ["Work"], 3)
 
-Based on this analysis: {"labels": ["AWS", "Finance"]}
+        assert result == [["Work"], [], []]
 
-These labels indicate the primary topics."""
+    def test_parse_batch_response_stray_brace_before_json(self):
+        """Test skipping braces that do not start the reply object."""
+        response = (
+            'Email {1} looks like work: {"classifications": '
+            '[{"index": 1, "labels": ["Work"]}]}'
+        )
+        assert parse_batch_labels_from_response(response, ["Work"], 1) == [["Work"]]
 
-        result = parse_labels_from_response(response, available_labels)
+    def test_parse_batch_response_invalid_json(self):
+        """Test that an unparseable response yields empty labels for all."""
+        assert parse_batch_labels_from_response("not json", ["Work"], 2) == [[], []]
+        assert parse_batch_labels_from_response('{"labels": [', ["Work"], 1) == [[]]
 
-        assert result == ["AWS", "Finance"]
 
-    def test_whitespace_handling(self, available_labels):
-        """Test handling of extra whitespace."""
-        response = """
+@pytest.mark.unit
+class TestLabelsResponseFormat:
+    """Test the structured-output JSON schemas."""
 
-        {"labels": ["AWS", "Finance"]}
+    def test_single_schema_restricts_labels(self):
+        fmt = labels_response_format(("Work", "AWS"), batch=False)
 
-        """
+        assert fmt["type"] == "json_schema"
+        assert fmt["json_schema"]["name"] == "email_labels"
+        assert fmt["json_schema"]["strict"] is True
+        schema = fmt["json_schema"]["schema"]
+        assert schema["required"] == ["labels"]
+        assert schema["additionalProperties"] is False
+        assert schema["properties"]["labels"]["items"]["enum"] == ["Work", "AWS"]
 
-        result = parse_labels_from_response(response, available_labels)
+    def test_batch_schema_has_indexed_classifications(self):
+        fmt = labels_response_format(("Work",), batch=True)
 
-        assert result == ["AWS", "Finance"]
+        assert fmt["json_schema"]["name"] == "email_classifications"
+        schema = fmt["json_schema"]["schema"]
+        assert schema["required"] == ["classifications"]
+        item = schema["properties"]["classifications"]["items"]
+        assert item["required"] == ["index", "labels"]
+        assert item["properties"]["index"] == {"type": "integer"}
+        assert item["properties"]["labels"]["items"]["enum"] == ["Work"]
 
-    def test_unicode_in_response(self, available_labels):
-        """Test handling Unicode characters in response."""
-        response = '{"labels": ["AWS", "Finance"]} ✓'
 
-        result = parse_labels_from_response(response, available_labels)
+@pytest.mark.unit
+class TestParseLabelsParsing:
+    """Test JSON parsing edge cases."""
 
-        assert result == ["AWS", "Finance"]
+    @pytest.fixture
+    def available_labels(self):
+        """Standard set of available labels for testing."""
+        return ["AWS", "Finance", "Work", "Personal"]
 
-    def test_duplicate_labels(self, available_labels):
-        """Test handling duplicate labels in response."""
-        response = '{"labels": ["AWS", "AWS", "Finance"]}'
+    @pytest.mark.parametrize(
+        "response,expected",
+        [
+            pytest.param(
+                '{"labels": ["AWS", "Finance"]}',
+                ["AWS", "Finance"],
+                id="plain_json_object",
+            ),
+            pytest.param(
+                '```json\n{"labels": ["AWS", "Finance"]}\n```',
+                ["AWS", "Finance"],
+                id="json_in_markdown_code_block",
+            ),
+            pytest.param(
+                '```\n{"labels": ["AWS", "Finance"]}\n```',
+                ["AWS", "Finance"],
+                id="json_in_code_block_without_language",
+            ),
+            pytest.param(
+                'Here are the labels: {"labels": ["AWS", "Finance"]}',
+                ["AWS", "Finance"],
+                id="json_with_text_before",
+            ),
+            pytest.param(
+                '{"labels": ["AWS", "Finance"]} These are the most relevant labels.',
+                ["AWS", "Finance"],
+                id="json_with_text_after",
+            ),
+            pytest.param(
+                'Based on analysis: {"labels": ["AWS", "Finance"]} Hope this helps!',
+                ["AWS", "Finance"],
+                id="json_with_text_before_and_after",
+            ),
+            pytest.param(
+                '["AWS", "Finance"]', ["AWS", "Finance"], id="json_array_format"
+            ),
+            # Missing closing brackets
+            pytest.param('{"labels": ["AWS", "Finance"', [], id="invalid_json"),
+            # Wrong key
+            pytest.param(
+                '{"results": ["AWS", "Finance"]}', [], id="json_with_wrong_structure"
+            ),
+            # Non-string values are filtered out
+            pytest.param(
+                '{"labels": ["AWS", 123, "Finance", null]}',
+                ["AWS", "Finance"],
+                id="json_with_non_string_labels",
+            ),
+            # Matched with proper casing
+            pytest.param(
+                '{"labels": ["aws", "FINANCE", "Work"]}',
+                ["AWS", "Finance", "Work"],
+                id="case_insensitive_matching",
+            ),
+            pytest.param(
+                '{"labels": ["AWS", "InvalidLabel", "Finance"]}',
+                ["AWS", "Finance"],
+                id="invalid_labels_filtered_out",
+            ),
+            pytest.param('{"labels": []}', [], id="empty_labels_array"),
+            pytest.param('{"labels": "AWS"}', [], id="labels_field_not_a_list"),
+            pytest.param(
+                '```json\n{\n  "labels": [\n    "AWS",\n    "Finance"\n  ]\n}\n```',
+                ["AWS", "Finance"],
+                id="multiline_json_in_code_block",
+            ),
+            pytest.param(
+                "The email discusses AWS billing and financial matters.\n\n"
+                'Based on this analysis: {"labels": ["AWS", "Finance"]}\n\n'
+                "These labels indicate the primary topics.",
+                ["AWS", "Finance"],
+                id="nested_json_extraction",
+            ),
+            # Brackets that do not start valid JSON are skipped
+            pytest.param(
+                'Options [AWS or {Finance}] -> {"labels": ["Finance"]}',
+                ["Finance"],
+                id="stray_braces_before_json",
+            ),
+            pytest.param(
+                '{"result": {"labels": ["AWS"]}, "notes": ["Finance"]}',
+                ["AWS"],
+                id="labels_object_nested_in_wrapper",
+            ),
+            pytest.param(
+                '\n\n        {"labels": ["AWS", "Finance"]}\n\n        ',
+                ["AWS", "Finance"],
+                id="whitespace_handling",
+            ),
+            pytest.param(
+                '{"labels": ["AWS", "Finance"]} ✓',
+                ["AWS", "Finance"],
+                id="unicode_in_response",
+            ),
+            # Duplicates are kept (the caller deduplicates if needed)
+            pytest.param(
+                '{"labels": ["AWS", "AWS", "Finance"]}',
+                ["AWS", "AWS", "Finance"],
+                id="duplicate_labels",
+            ),
+        ],
+    )
+    def test_parse_response(self, available_labels, response, expected):
+        """Test that each response shape yields the expected labels."""
+        assert parse_labels_from_response(response, available_labels) == expected
+
+    def test_case_insensitive_match_not_reported_invalid(
+        self, available_labels, caplog
+    ):
+        """Test that case-corrected labels are not logged as filtered out."""
+        response = '{"labels": ["aws", "Unknown"]}'
 
         result = parse_labels_from_response(response, available_labels)
 
-        # Should include duplicates (let caller handle deduplication if needed)
-        assert result == ["AWS", "AWS", "Finance"]
+        assert result == ["AWS"]
+        assert "Filtered out invalid labels: ['Unknown']" in caplog.text
 
 
 @pytest.mark.unit
@@ -350,60 +400,55 @@ class TestLogClassificationResult:
 
     def test_log_with_labels(self, caplog):
         """Test logging when labels are predicted."""
-        import logging
-
         caplog.set_level(logging.INFO)
 
         email = {"subject": "Test Email Subject"}
-        labels = ["AWS", "Finance"]
-        provider = "TestProvider"
-
-        log_classification_result(email, labels, provider)
+        log_classification_result(email, ["AWS", "Finance"], "TestProvider")
 
-        assert "TestProvider" in caplog.text
-        assert "Test Email Subject" in caplog.text
-        assert "AWS" in caplog.text
-        assert "Finance" in caplog.text
+        assert caplog.record_tuples == [
+            (
+                "llm_utils",
+                logging.INFO,
+                "[TestProvider] Classified 'Test Email Subject...' with labels: "
+                "['AWS', 'Finance']",
+            )
+        ]
 
     def test_log_without_labels(self, caplog):
         """Test logging when no labels are predicted."""
-        import logging
-
         caplog.set_level(logging.WARNING)
 
         email = {"subject": "Test Email"}
-        labels = []
-        provider = "TestProvider"
-
-        log_classification_result(email, labels, provider)
+        log_classification_result(email, [], "TestProvider")
 
-        assert "No labels predicted" in caplog.text
+        assert caplog.record_tuples == [
+            (
+                "llm_utils",
+                logging.WARNING,
+                "[TestProvider] No labels predicted for 'Test Email...'",
+            )
+        ]
 
     def test_log_with_long_subject(self, caplog):
         """Test logging with long email subject (should be truncated)."""
-        import logging
-
         caplog.set_level(logging.INFO)
 
         email = {"subject": "A" * 100}
-        labels = ["AWS"]
-        provider = "TestProvider"
-
-        log_classification_result(email, labels, provider)
+        log_classification_result(email, ["AWS"], "TestProvider")
 
         # Should truncate at 50 chars
-        assert caplog.text.count("A") <= 53  # 50 + '...'
+        [(_, _, message)] = caplog.record_tuples
+        assert (
+            message == f"[TestProvider] Classified '{'A' * 50}...' with labels: ['AWS']"
+        )
 
     def test_log_with_no_subject(self, caplog):
         """Test logging when email has no subject."""
-        import logging
-
         caplog.set_level(logging.INFO)
 
-        email = {}
-        labels = ["AWS"]
-        provider = "TestProvider"
+        log_classification_result({}, ["AWS"], "TestProvider")
 
-        log_classification_result(email, labels, provider)
-
-        assert "No Subject" in caplog.text
+        [(_, _, message)] = caplog.record_tuples
+        assert (
+            message == "[TestProvider] Classified 'No Subject...' with labels: ['AWS']"
+        )
@@ -2,11 +2,14 @@
 Unit tests for openrouter_classifier.py
 """
 
-from unittest.mock import Mock, MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
 import pytest
 
-from openrouter_classifier import OpenRouterClassifier
+from classification_cache import ClassificationCache
+from llm_utils import labels_response_format
+from openrouter_classifier import OpenRouterClassifier, TruncatedResponseError
 
 
 @pytest.fixture
@@ -29,15 +32,11 @@ def classification_prompt():
     return "Classify this email into one of the available labels."
 
 
-def _mock_openai_response(content: str):
-    """Build a mock OpenAI SDK chat-completion response whose content is `content`."""
-    message = Mock()
-    message.content = content
-    choice = Mock()
-    choice.message = message
-    response = Mock()
-    response.choices = [choice]
-    return response
+def _mock_openai_response(content: str, finish_reason: str = "stop"):
+    """Build a chat-completion response shaped like the OpenAI SDK's."""
+    message = SimpleNamespace(content=content)
+    choice = SimpleNamespace(message=message, finish_reason=finish_reason)
+    return SimpleNamespace(choices=[choice], usage=None)
 
 
 @pytest.mark.unit
@@ -51,7 +50,8 @@ class TestOpenRouterClassifierInit:
 
         assert classifier.model == "anthropic/claude-3.5-sonnet"
         assert classifier.temperature == 0.0
-        assert classifier.max_tokens == 1000
+        assert classifier.max_tokens == 64
+        assert classifier.structured_output is False
 
     def test_init_stores_custom_values(self):
         with patch("openai.OpenAI") as mock_openai:
@@ -78,6 +78,20 @@ class TestOpenRouterClassifierInit:
         assert "HTTP-Referer" in kwargs["default_headers"]
         assert "X-Title" in kwargs["default_headers"]
 
+    def test_init_configures_retries_and_timeout(self):
+        with patch("openai.OpenAI") as mock_openai:
+            OpenRouterClassifier(api_key="test-key", max_retries=3, timeout=30.0)
+
+        _, kwargs = mock_openai.call_args
+        assert kwargs["max_retries"] == 3
+        assert kwargs["timeout"].read == 30.0
+        assert kwargs["timeout"].connect == 5.0
+
+    def test_init_without_openai_package_raises(self):
+        with patch("openrouter_classifier.openai", None):
+            with pytest.raises(ImportError, match="openai package is required"):
+                OpenRouterClassifier(api_key="test-key")
+
 
 @pytest.mark.unit
 class TestOpenRouterClassifyEmail:
@@ -128,6 +142,26 @@ class TestOpenRouterClassifyEmail:
         assert kwargs["messages"][0]["role"] == "system"
         assert kwargs["messages"][1]["role"] == "user"
 
+    @pytest.mark.parametrize(
+        "model,cached",
+        [("anthropic/claude-3.5-sonnet", True), ("openai/gpt-4o", False)],
+    )
+    def test_prompt_cache_breakpoint_for_anthropic_models(
+        self, model, cached, sample_email, available_labels, classification_prompt
+    ):
+        with patch("openai.OpenAI"):
+            classifier = OpenRouterClassifier(api_key="test-key", model=model)
+        classifier.client = MagicMock()
+        classifier.client.chat.completions.create.return_value = _mock_openai_response(
+            '{"labels": []}'
+        )
+
+        classifier.classify_email(sample_email, classification_prompt, available_labels)
+
+        _, kwargs = classifier.client.chat.completions.create.call_args
+        system_content = kwargs["messages"][0]["content"]
+        assert isinstance(system_content, list) is cached
+
     def test_classify_email_returns_empty_when_api_errors(
         self, sample_email, available_labels, classification_prompt
     ):
@@ -152,8 +186,7 @@ class TestOpenRouterClassifyEmail:
             sample_email, classification_prompt, available_labels
         )
 
-        assert "Billing" in result
-        assert "NotARealLabel" not in result
+        assert result == ["Billing"]
 
     def test_classify_email_handles_empty_label_response(
         self, sample_email, available_labels, classification_prompt
@@ -168,3 +201,200 @@ class TestOpenRouterClassifyEmail:
         )
 
         assert result == []
+
+    def test_classify_email_raises_when_truncated(
+        self, sample_email, available_labels, classification_prompt, caplog
+    ):
+        classifier = self._build_classifier()
+        response = _mock_openai_response('{"labels": ["Bill', finish_reason="length")
+        classifier.client.chat.completions.create.return_value = response
+
+        # A cut-off reply is not a "no labels" answer, so it must not
+        # come back as [] and get the email marked processed
+        with pytest.raises(TruncatedResponseError):
+            classifier.classify_email(
+                sample_email, classification_prompt, available_labels
+            )
+
+        assert "hit max_tokens" in caplog.text
+
+    def test_classify_email_keeps_labels_from_truncated_reply(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        response = _mock_openai_response(
+            '{"labels": ["Billing"]}', finish_reason="length"
+        )
+        classifier.client.chat.completions.create.return_value = response
+
+        result = classifier.classify_email(
+            sample_email, classification_prompt, available_labels
+        )
+
+        assert result == ["Billing"]
+
+
+@pytest.mark.unit
+class TestOpenRouterClassifierCache:
+    """Test the classification cache in front of the API."""
+
+    def _build_classifier(self):
+        with patch("openai.OpenAI"):
+            classifier = OpenRouterClassifier(
+                api_key="test-key", cache=ClassificationCache()
+            )
+        classifier.client = MagicMock()
+        classifier.client.chat.completions.create.return_value = _mock_openai_response(
+            '{"labels": ["Billing"]}'
+        )
+        return classifier
+
+    def test_repeat_email_served_from_cache(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+
+        first = classifier.classify_email(
+            sample_email, classification_prompt, available_labels
+        )
+        second = classifier.classify_email(
+            dict(sample_email), classification_prompt, available_labels
+        )
+
+        assert first == second == ["Billing"]
+        assert classifier.client.chat.completions.create.call_count == 1
+
+    def test_empty_result_not_cached(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        classifier.client.chat.completions.create.side_effect = [
+            RuntimeError("boom"),
+            _mock_openai_response('{"labels": ["Billing"]}'),
+        ]
+
+        assert (
+            classifier.classify_email(
+                sample_email, classification_prompt, available_labels
+            )
+            == []
+        )
+        assert classifier.classify_email(
+            sample_email, classification_prompt, available_labels
+        ) == ["Billing"]
+        assert classifier.client.chat.completions.create.call_count == 2
+
+    def test_near_duplicate_served_from_cache(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        classifier.cache = ClassificationCache(near_duplicates=True)
+        body = (
+            "Your invoice {} for this month is now available. The total will be "
+            "charged to the card on file on the first business day of next month."
+        )
+
+        first = classifier.classify_email(
+            dict(sample_email, body=body.format("INV-1001")),
+            classification_prompt,
+            available_labels,
+        )
+        second = classifier.classify_email(
+            dict(sample_email, body=body.format("INV-2002")),
+            classification_prompt,
+            available_labels,
+        )
+
+        assert first == second == ["Billing"]
+        assert classifier.client.chat.completions.create.call_count == 1
+
+    def test_structured_output_off_by_default(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+
+        classifier.classify_email(sample_email, classification_prompt, available_labels)
+
+        call = classifier.client.chat.completions.create.call_args
+        assert "response_format" not in call.kwargs
+
+    def test_structured_output_sends_label_schema(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        classifier.structured_output = True
+        classifier.cache = None
+
+        classifier.classify_email(sample_email, classification_prompt, available_labels)
+        single = classifier.client.chat.completions.create.call_args.kwargs
+
+        classifier.client.chat.completions.create.return_value = _mock_openai_response(
+            '{"classifications": []}'
+        )
+        classifier.classify_emails_batch(
+            [sample_email, dict(sample_email, subject="Other")],
+            classification_prompt,
+            available_labels,
+        )
+        batch = classifier.client.chat.completions.create.call_args.kwargs
+
+        assert single["response_format"] == labels_response_format(
+            tuple(available_labels), batch=False
+        )
+        assert batch["response_format"] == labels_response_format(
+            tuple(available_labels), batch=True
+        )
+
+    def test_batch_sends_only_cache_misses(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        classifier.classify_email(sample_email, classification_prompt, available_labels)
+        other = dict(sample_email, subject="Lunch on Friday?", body="Are you free?")
+        classifier.client.chat.completions.create.return_value = _mock_openai_response(
+            '{"classifications": [{"index": 1, "labels": ["Personal"]}]}'
+        )
+
+        result = classifier.classify_emails_batch(
+            [sample_email, other], classification_prompt, available_labels
+        )
+
+        assert result == [["Billing"], ["Personal"]]
+        call = classifier.client.chat.completions.create.call_args
+        assert "Lunch on Friday?" in call.kwargs["messages"][1]["content"]
+        assert "Your AWS Bill" not in call.kwargs["messages"][1]["content"]
+        assert call.kwargs["max_tokens"] == classifier.max_tokens
+        # The batch result was cached too
+        assert classifier.classify_email(
+            other, classification_prompt, available_labels
+        ) == ["Personal"]
+        assert classifier.client.chat.completions.create.call_count == 2
+
+    def test_batch_raises_when_truncated(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        other = dict(sample_email, subject="Lunch on Friday?", body="Are you free?")
+        classifier.client.chat.completions.create.return_value = _mock_openai_response(
+            '{"classifications": [{"index": 1, "labels": ["Billing"]}, {"ind',
+            finish_reason="length",
+        )
+
+        with pytest.raises(TruncatedResponseError):
+            classifier.classify_emails_batch(
+                [sample_email, other], classification_prompt, available_labels
+            )
+
+    def test_batch_api_error_returns_empty_labels(
+        self, sample_email, available_labels, classification_prompt
+    ):
+        classifier = self._build_classifier()
+        classifier.client.chat.completions.create.side_effect = RuntimeError("boom")
+
+        result = classifier.classify_emails_batch(
+            [sample_email, dict(sample_email, subject="Other")],
+            classification_prompt,
+            available_labels,
+        )
+
+        assert result == [[], []]
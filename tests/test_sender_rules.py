@@ -0,0 +1,66 @@
+"""
+Unit tests for sender_rules.py
+"""
+
+import pytest
+
+from sender_rules import SenderRules, compile_rules
+
+
+@pytest.fixture
+def rules():
+    return {
+        "Github": {"from": ["@github.com"], "subject": [r"^\[GitHub\]"]},
+        "AWS": {"from": ["@amazonaws.com", "aws-billing@"]},
+    }
+
+
+@pytest.mark.unit
+class TestSenderRules:
+    """Test rule matching."""
+
+    def test_matches_sender_substring_case_insensitively(self, rules):
+        matcher = SenderRules(rules)
+
+        assert matcher.match({"from": "Notifications <NOREPLY@GitHub.com>"}) == [
+            "Github"
+        ]
+
+    def test_matches_subject_pattern(self, rules):
+        matcher = SenderRules(rules)
+
+        result = matcher.match(
+            {"from": "someone@example.com", "subject": "[GitHub] New issue"}
+        )
+
+        assert result == ["Github"]
+
+    def test_sender_is_escaped_not_regex(self):
+        matcher = SenderRules({"AWS": {"from": ["a.b@x.com"]}})
+
+        assert matcher.match({"from": "aXb@x.com"}) == []
+
+    def test_multiple_labels_in_rule_order(self, rules):
+        matcher = SenderRules(rules)
+
+        result = matcher.match(
+            {"from": "aws-billing@amazonaws.com", "subject": "[GitHub] Bill"}
+        )
+
+        assert result == ["Github", "AWS"]
+
+    def test_no_match_and_hit_counters(self, rules):
+        matcher = SenderRules(rules)
+
+        assert matcher.match({"from": "friend@example.com", "subject": "Hi"}) == []
+        matcher.match({"from": "noreply@github.com"})
+
+        assert matcher.checked == 2
+        assert matcher.matched == 1
+
+    def test_missing_fields(self, rules):
+        assert SenderRules(rules).match({}) == []
+
+    def test_invalid_subject_pattern(self):
+        with pytest.raises(ValueError, match="Invalid subject pattern"):
+            compile_rules({"Github": {"subject": ["["]}})
@@ -5,35 +5,51 @@ Setup Verification Script
 Checks that all prerequisites are configured correctly before running the agent.
 """
 
+import importlib.util
 import os
 import sys
 from pathlib import Path
+from typing import Optional
 
-# ANSI color codes for terminal output
-GREEN = "\033[92m"
-RED = "\033[91m"
-YELLOW = "\033[93m"
-RESET = "\033[0m"
+# ANSI color codes for terminal output; any NO_COLOR value turns them off
+# (https://no-color.org), e.g. for CI logs
+if os.environ.get("NO_COLOR"):
+    GREEN = RED = YELLOW = RESET = ""
+else:
+    GREEN = "\033[92m"
+    RED = "\033[91m"
+    YELLOW = "\033[93m"
+    RESET = "\033[0m"
+
+# Status marks, formatted once
+OK = f"{GREEN}✓{RESET}"
+FAIL = f"{RED}✗{RESET}"
+WARN = f"{YELLOW}⚠{RESET}"
+
+# Example key shipped in .env.example
+OPENROUTER_KEY_PLACEHOLDER = "sk-or-v1-" + "x" * 64
 
 
 def check_file_exists(filepath: str, name: str) -> bool:
     """Check if a file exists."""
     if Path(filepath).exists():
-        print(f"{GREEN}✓{RESET} {name} found at: {filepath}")
+        print(f"{OK} {name} found at: {filepath}")
         return True
     else:
-        print(f"{RED}✗{RESET} {name} NOT found at: {filepath}")
+        print(f"{FAIL} {name} NOT found at: {filepath}")
         return False
 
 
-def check_env_variable(var_name: str) -> bool:
-    """Check if an environment variable is set."""
+def check_env_variable(var_name: str, placeholder: Optional[str] = None) -> bool:
+    """Check if an environment variable is set to a non-placeholder value."""
     value = os.getenv(var_name)
-    if value and value != f"your_{var_name.lower()}":
-        print(f"{GREEN}✓{RESET} {var_name} is set")
+    if placeholder is None:
+        placeholder = f"your_{var_name.lower()}"
+    if value and value != placeholder:
+        print(f"{OK} {var_name} is set")
         return True
     else:
-        print(f"{RED}✗{RESET} {var_name} is NOT set or has default value")
+        print(f"{FAIL} {var_name} is NOT set or has default value")
         return False
 
 
@@ -41,13 +57,11 @@ def check_python_version() -> bool:
     """Check Python version."""
     version = sys.version_info
     if version.major == 3 and version.minor >= 11:
-        print(
-            f"{GREEN}✓{RESET} Python version: {version.major}.{version.minor}.{version.micro}"
-        )
+        print(f"{OK} Python version: {version.major}.{version.minor}.{version.micro}")
         return True
     else:
         print(
-            f"{RED}✗{RESET} Python version {version.major}.{version.minor}.{version.micro} (requires 3.11+)"
+            f"{FAIL} Python version {version.major}.{version.minor}.{version.micro} (requires 3.11+)"
         )
         return False
 
@@ -57,55 +71,30 @@ def check_dependencies() -> bool:
     required_packages = [
         "google.auth",
         "google_auth_oauthlib",
+        "google_auth_httplib2",
         "googleapiclient",
-        "boto3",
+        "openai",
         "dotenv",
     ]
 
     all_installed = True
     for package in required_packages:
+        # find_spec locates the package without executing it, so the heavy
+        # Google and OpenAI client modules are not imported just to probe
         try:
-            __import__(package.replace("-", "_"))
-            print(f"{GREEN}✓{RESET} Package installed: {package}")
+            found = importlib.util.find_spec(package) is not None
         except ImportError:
-            print(f"{RED}✗{RESET} Package NOT installed: {package}")
+            found = False
+
+        if found:
+            print(f"{OK} Package installed: {package}")
+        else:
+            print(f"{FAIL} Package NOT installed: {package}")
             all_installed = False
 
     return all_installed
 
 
-def check_aws_credentials() -> bool:
-    """Check AWS credentials."""
-    try:
-        import boto3
-        from botocore.exceptions import ClientError, NoCredentialsError
-
-        # Try to create a Bedrock client
-        client = boto3.client(
-            "bedrock-runtime", region_name=os.getenv("AWS_REGION", "us-east-1")
-        )
-
-        # Try to list available models (this will fail if credentials are wrong)
-        print(f"{GREEN}✓{RESET} AWS credentials are valid")
-        return True
-
-    except NoCredentialsError:
-        print(f"{RED}✗{RESET} AWS credentials not found")
-        return False
-    except ClientError as e:
-        error_code = e.response["Error"]["Code"]
-        if error_code == "UnrecognizedClientException":
-            print(f"{RED}✗{RESET} AWS credentials are invalid")
-        else:
-            print(
-                f"{YELLOW}⚠{RESET} AWS credentials found but couldn't verify Bedrock access: {error_code}"
-            )
-        return False
-    except Exception as e:
-        print(f"{YELLOW}⚠{RESET} Could not verify AWS credentials: {str(e)}")
-        return False
-
-
 def main():
     """Run all verification checks."""
     print("=" * 60)
@@ -122,20 +111,23 @@ def main():
 
     # Check required files
     print("2. Required Files")
-    checks.append(check_file_exists(".env", ".env configuration file"))
+    env_file_found = check_file_exists(".env", ".env configuration file")
+    checks.append(env_file_found)
     checks.append(check_file_exists("credentials.json", "Gmail OAuth credentials"))
     print()
 
     # Check environment variables
     print("3. Environment Variables")
-    from dotenv import load_dotenv
+    if env_file_found:
+        # Load the file found above directly instead of letting dotenv
+        # search parent directories for one
+        from dotenv import load_dotenv
 
-    load_dotenv()
+        load_dotenv(".env")
+    else:
+        print(f"{WARN} No .env file; checking the current environment only")
 
-    checks.append(check_env_variable("AWS_REGION"))
-    checks.append(check_env_variable("AWS_ACCESS_KEY_ID"))
-    checks.append(check_env_variable("AWS_SECRET_ACCESS_KEY"))
-    checks.append(check_env_variable("BEDROCK_MODEL_ID"))
+    checks.append(check_env_variable("OPENROUTER_API_KEY", OPENROUTER_KEY_PLACEHOLDER))
     print()
 
     # Check dependencies
@@ -143,11 +135,6 @@ def main():
     checks.append(check_dependencies())
     print()
 
-    # Check AWS credentials
-    print("5. AWS Bedrock Access")
-    checks.append(check_aws_credentials())
-    print()
-
     # Summary
     print("=" * 60)
     passed = sum(checks)